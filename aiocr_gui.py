@@ -1,10 +1,24 @@
 import sys
 import os
+import threading
+from collections import deque
 import yaml
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QLabel, QPushButton, QLineEdit, QTextEdit, QFileDialog, QComboBox, QSpinBox, QVBoxLayout, QHBoxLayout, QFormLayout, QMessageBox, QDialog
+    QApplication, QWidget, QLabel, QPushButton, QLineEdit, QTextEdit, QFileDialog, QComboBox, QSpinBox, QVBoxLayout, QHBoxLayout, QFormLayout, QMessageBox, QDialog,
+    QProgressBar
 )
-from PyQt5.QtCore import Qt, pyqtSignal, QThread
+from PyQt5.QtCore import Qt, pyqtSignal, QThread, QTimer
+
+# 日志刷新间隔（毫秒），同一间隔内的日志合并后一次性写入日志框
+LOG_FLUSH_INTERVAL_MS = 200
+# 日志框保留的最大行数，超出后丢弃最早的日志
+LOG_MAX_LINES = 5000
+
+
+def format_seconds(seconds):
+    """将秒数格式化为 H:MM:SS。"""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
 
 class SettingsDialog(QDialog):
     def __init__(self, parent=None):
@@ -78,11 +92,15 @@ class SettingsDialog(QDialog):
 
 class ProcessThread(QThread):
     log_signal = pyqtSignal(str)
+    progress_signal = pyqtSignal(dict)
     finished_signal = pyqtSignal()
     error_signal = pyqtSignal(str)
 
     def __init__(self, input_dir, output_dir, client_type, openai_baseurl, openai_key, openai_model,
-                 genai_key, genai_model, bind, translate_to, max_workers, timeout, parent=None):
+                 genai_key, genai_model, bind, translate_to, max_workers, timeout,
+                 budget_max_tokens=0, budget_max_cost=0, pricing=None, output_tokens_per_image=400,
+                 job_db=None, lease_seconds=60, worker_id=None, job_name=None,
+                 text_region_mode=None, structured_output=False, parent=None):
         super().__init__(parent)
         self.input_dir = input_dir
         self.output_dir = output_dir
@@ -96,6 +114,24 @@ class ProcessThread(QThread):
         self.translate_to = translate_to
         self.max_workers = max_workers
         self.timeout = timeout
+        self.budget_max_tokens = budget_max_tokens
+        self.budget_max_cost = budget_max_cost
+        self.pricing = pricing
+        self.output_tokens_per_image = output_tokens_per_image
+        self.job_db = job_db
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id
+        self.job_name = job_name
+        self.text_region_mode = text_region_mode
+        self.structured_output = structured_output
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """请求取消：不再提交新的批次，进行中的批次完成后结束。"""
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
 
     def run(self):
         try:
@@ -113,7 +149,19 @@ class ProcessThread(QThread):
                 self.translate_to,
                 self.max_workers,
                 self.timeout,
-                logger_callback=self.log_signal.emit
+                logger_callback=self.log_signal.emit,
+                progress_callback=self.progress_signal.emit,
+                cancel_event=self.cancel_event,
+                budget_max_tokens=self.budget_max_tokens,
+                budget_max_cost=self.budget_max_cost,
+                pricing=self.pricing,
+                output_tokens_per_image=self.output_tokens_per_image,
+                job_db=self.job_db,
+                lease_seconds=self.lease_seconds,
+                worker_id=self.worker_id,
+                job_name=self.job_name,
+                text_region_mode=self.text_region_mode,
+                structured_output=self.structured_output
             )
             self.finished_signal.emit()
         except ImportError:
@@ -121,6 +169,36 @@ class ProcessThread(QThread):
         except Exception as e:
             self.error_signal.emit(f'处理过程中发生错误: {str(e)}')
 
+class PlanThread(QThread):
+    result_signal = pyqtSignal(str)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, input_dir, client_type, model, bind, max_workers, settings, parent=None):
+        super().__init__(parent)
+        self.input_dir = input_dir
+        self.client_type = client_type
+        self.model = model
+        self.bind = bind
+        self.max_workers = max_workers
+        self.settings = settings
+
+    def run(self):
+        try:
+            import planner
+            plan = planner.plan_directory(
+                self.input_dir, self.client_type, self.model, self.bind, self.max_workers,
+                pricing=self.settings.get('pricing') or None,
+                output_tokens_per_image=self.settings.get('output_tokens_per_image', 400),
+                seconds_per_request=self.settings.get('seconds_per_request', 20),
+                rate_limit_rpm=self.settings.get('rate_limit_rpm', 0),
+                rate_limit_tpm=self.settings.get('rate_limit_tpm', 0),
+                observed=planner.load_stats(
+                    os.path.join(self.settings.get('output', ''), planner.STATS_FILE), self.model)
+            )
+            self.result_signal.emit(planner.format_plan(plan))
+        except Exception as e:
+            self.error_signal.emit(f'预估过程中发生错误: {str(e)}')
+
 class AiOCRGui(QWidget):
     def __init__(self):
         super().__init__()
@@ -137,11 +215,29 @@ class AiOCRGui(QWidget):
             'clientType': 'openai',
             'proxy': '',
             'max_workers': 5,
-            'timeout': 30
+            'timeout': 30,
+            'budget_max_tokens': 0,
+            'budget_max_cost': 0,
+            'pricing': {},
+            'output_tokens_per_image': 400,
+            'seconds_per_request': 20,
+            'rate_limit_rpm': 0,
+            'rate_limit_tpm': 0,
+            'job_db': '',
+            'lease_seconds': 60,
+            'worker_id': '',
+            'job_name': '',
+            'text_region_mode': '',
+            'structured_output': False
         }
         self.load_config()
+        self.pending_logs = deque(maxlen=LOG_MAX_LINES)
         self.init_ui()
         self.process_thread = None
+        self.plan_thread = None
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log_messages)
+        self.log_timer.start(LOG_FLUSH_INTERVAL_MS)
 
     def load_config(self):
         if getattr(sys, 'frozen', False):
@@ -169,7 +265,20 @@ class AiOCRGui(QWidget):
                             'clientType': 'clientType',
                             'proxy': 'proxy',
                             'max_workers': 'max_workers',
-                            'timeout': 'timeout'
+                            'timeout': 'timeout',
+                            'budget_max_tokens': 'budget_max_tokens',
+                            'budget_max_cost': 'budget_max_cost',
+                            'pricing': 'pricing',
+                            'output_tokens_per_image': 'output_tokens_per_image',
+                            'seconds_per_request': 'seconds_per_request',
+                            'rate_limit_rpm': 'rate_limit_rpm',
+                            'rate_limit_tpm': 'rate_limit_tpm',
+                            'job_db': 'job_db',
+                            'lease_seconds': 'lease_seconds',
+                            'worker_id': 'worker_id',
+                            'job_name': 'job_name',
+                            'text_region_mode': 'text_region_mode',
+                            'structured_output': 'structured_output'
                         }
                         for yaml_key, settings_key in mapping.items():
                             if yaml_key in config_data:
@@ -185,7 +294,15 @@ class AiOCRGui(QWidget):
             # 如果应用程序是作为普通的Python脚本运行的
             application_path = os.path.dirname(__file__)
         config_path = os.path.join(application_path, 'config.yaml')
-        config_to_save = {
+        # 保留界面中没有对应设置项的配置（例如分布式、预算相关配置）
+        config_to_save = {}
+        if os.path.exists(config_path):
+            try:
+                with open(config_path, 'r', encoding='utf-8') as f:
+                    config_to_save = yaml.safe_load(f) or {}
+            except Exception as e:
+                print(f'加载配置文件出错: {e}')
+        config_to_save.update({
             'input': self.settings.get('input', ''),
             'output': self.settings.get('output', ''),
             'openai_base_url': self.settings.get('openai_baseurl', 'https://api.openai.com/v1'),
@@ -199,7 +316,7 @@ class AiOCRGui(QWidget):
             'proxy': self.settings.get('proxy', ''),
             'max_workers': self.settings.get('max_workers', 5),
             'timeout': self.settings.get('timeout', 30)
-        }
+        })
         try:
             with open(config_path, 'w', encoding='utf-8') as f:
                 yaml.dump(config_to_save, f, allow_unicode=True, sort_keys=False)
@@ -239,14 +356,28 @@ class AiOCRGui(QWidget):
         self.settings_btn.clicked.connect(self.open_settings)
         self.start_btn = QPushButton('开始处理')
         self.start_btn.clicked.connect(self.start_process)
+        self.plan_btn = QPushButton('预估')
+        self.plan_btn.clicked.connect(self.start_plan)
+        self.cancel_btn = QPushButton('取消')
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_process)
         btn_layout = QHBoxLayout()
         btn_layout.addWidget(self.settings_btn)
+        btn_layout.addWidget(self.plan_btn)
         btn_layout.addWidget(self.start_btn)
+        btn_layout.addWidget(self.cancel_btn)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(0)
+        self.progress_label = QLabel('')
         self.log_text = QTextEdit()
         self.log_text.setReadOnly(True)
+        self.log_text.document().setMaximumBlockCount(LOG_MAX_LINES)
         layout = QVBoxLayout()
         layout.addLayout(form_layout)
         layout.addLayout(btn_layout)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.progress_label)
         layout.addWidget(QLabel('日志输出:'))
         layout.addWidget(self.log_text)
         self.setLayout(layout)
@@ -283,7 +414,68 @@ class AiOCRGui(QWidget):
             self.save_config()
 
     def append_log_message(self, message):
-        self.log_text.append(message)
+        # 只放入缓冲区，由定时器合并写入，避免大量日志时界面卡顿
+        self.pending_logs.append(message)
+
+    def flush_log_messages(self):
+        if not self.pending_logs:
+            return
+        messages = list(self.pending_logs)
+        self.pending_logs.clear()
+        self.log_text.append('\n'.join(messages))
+
+    def update_progress(self, event):
+        total = max(event.get('total', 0), 1)
+        done = min(event.get('done', 0), total)
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        eta = event.get('eta')
+        eta_text = format_seconds(eta) if eta is not None else '--:--:--'
+        self.progress_label.setText(
+            f"{event.get('done', 0)}/{event.get('total', 0)} 张图片，"
+            f"{event.get('rate', 0.0):.2f} 张/秒，已用 {format_seconds(event.get('elapsed', 0))}，"
+            f"预计剩余 {eta_text}"
+        )
+
+    def start_plan(self):
+        if self.plan_thread and self.plan_thread.isRunning():
+            return
+        input_dir = self.input_edit.text().strip()
+        if not input_dir:
+            QMessageBox.warning(self, '参数错误', '请输入输入目录！')
+            return
+        client_type = self.client_combo.currentText()
+        if client_type == 'openai':
+            model = self.settings.get('openai_model', 'gpt-4-vision-preview')
+        else:
+            model = self.settings.get('genai_model', 'gemini-1.5-flash-latest')
+        self.plan_btn.setEnabled(False)
+        self.append_log_message('正在预估处理量（只读取图片文件头）...')
+        self.plan_thread = PlanThread(
+            input_dir, client_type, model, self.settings.get('bind', 10),
+            self.settings.get('max_workers', 5), dict(self.settings)
+        )
+        self.plan_thread.result_signal.connect(self.handle_plan_result)
+        self.plan_thread.error_signal.connect(self.handle_plan_error)
+        self.plan_thread.start()
+
+    def handle_plan_result(self, message):
+        self.append_log_message(message)
+        self.flush_log_messages()
+        self.plan_btn.setEnabled(True)
+        QMessageBox.information(self, '预估结果', message)
+
+    def handle_plan_error(self, error_message):
+        self.append_log_message(error_message)
+        self.flush_log_messages()
+        self.plan_btn.setEnabled(True)
+        QMessageBox.critical(self, '预估错误', error_message)
+
+    def cancel_process(self):
+        if self.process_thread and self.process_thread.isRunning():
+            self.process_thread.cancel()
+            self.cancel_btn.setEnabled(False)
+            self.append_log_message('正在取消：等待进行中的批次完成，已完成的结果将被保存...')
 
     def start_process(self):
         if self.process_thread and self.process_thread.isRunning():
@@ -331,27 +523,51 @@ class AiOCRGui(QWidget):
 
         self.start_btn.setEnabled(False)
         self.settings_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(0)
+        self.progress_label.setText('')
 
         self.process_thread = ProcessThread(
             input_dir, output_dir, client_type, openai_baseurl, openai_key, openai_model,
-            genai_key, genai_model, bind, translate_to, max_workers, timeout
+            genai_key, genai_model, bind, translate_to, max_workers, timeout,
+            budget_max_tokens=self.settings.get('budget_max_tokens', 0),
+            budget_max_cost=self.settings.get('budget_max_cost', 0),
+            pricing=self.settings.get('pricing') or None,
+            output_tokens_per_image=self.settings.get('output_tokens_per_image', 400),
+            job_db=self.settings.get('job_db') or None,
+            lease_seconds=self.settings.get('lease_seconds', 60),
+            worker_id=self.settings.get('worker_id') or None,
+            job_name=self.settings.get('job_name') or None,
+            text_region_mode=self.settings.get('text_region_mode') or None,
+            structured_output=bool(self.settings.get('structured_output'))
         )
         self.process_thread.log_signal.connect(self.append_log_message)
+        self.process_thread.progress_signal.connect(self.update_progress)
         self.process_thread.finished_signal.connect(self.handle_process_finished)
         self.process_thread.error_signal.connect(self.handle_process_error)
         self.process_thread.start()
 
     def handle_process_finished(self):
-        self.append_log_message('所有图片处理完成！')
-        QMessageBox.information(self, '完成', '所有图片处理完成！')
-        self.start_btn.setEnabled(True)
-        self.settings_btn.setEnabled(True)
+        if self.process_thread and self.process_thread.is_cancelled():
+            message = '处理已取消，已完成的结果已保存。'
+        else:
+            message = '所有图片处理完成！'
+        self.append_log_message(message)
+        self.flush_log_messages()
+        self.reset_buttons()
+        QMessageBox.information(self, '完成', message)
 
     def handle_process_error(self, error_message):
         self.append_log_message(error_message)
+        self.flush_log_messages()
+        self.reset_buttons()
         QMessageBox.critical(self, '处理错误', error_message)
+
+    def reset_buttons(self):
         self.start_btn.setEnabled(True)
         self.settings_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
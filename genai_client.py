@@ -5,45 +5,55 @@ from PIL import Image
 import io
 import os
 
-def extract_text_from_images(image_paths, api_key, model, translate_to):
+import structured_output
+
+def extract_text_from_images(image_paths, api_key, model, translate_to, structured=False, usage_callback=None):
     """
     在单个请求中使用 Google GenAI 的 Vision API 从多张图片中提取文本。
     代理设置通过环境变量 HTTP_PROXY 和 HTTPS_PROXY 控制。
 
     参数:
-        image_paths (list): 图片文件路径的列表。
+        image_paths (list): 图片文件路径的列表，也可以包含已解码的页面 (PIL Image)。
         api_key (str): Google GenAI API 密钥。
         model (str): 要使用的 Google GenAI 模型名称 (例如 'gemini-pro-vision')。
         translate_to (str): 要翻译的目标语言。
+        structured (bool): 是否使用 response_schema 结构化输出，按序号返回每张图片的文本，
+            不再依赖 '###IMAGE_N###' 分隔标记。
+        usage_callback (callable): 可选的回调函数，接收本次请求实际使用的 (输入 token, 输出 token)。
 
     返回值:
-        list: 包含对应每张图片提取的文本的列表。
+        list | None: 包含对应每张图片提取的文本的列表；图片读取失败或 API 请求失败时返回 None，
+            以便与图片确实没有文本（空字符串）区分。
     """
     try:
         genai.configure(api_key=api_key)
     except Exception as e:
         print(f"配置 GenAI 时出错: {str(e)}")
-        return [""] * len(image_paths)
+        return None
 
     content_sub = f"并翻译为{translate_to}" if translate_to else ""
     prompt = f"对于每张图片，提取文本{content_sub}，可以适当根据前后文对原文进行纠错或补充。\
         在每个图片文本前使用唯一的标识符格式化响应，例如：第一张图片文本前添加 '###IMAGE_1###'，\
         第二张图片文本前添加 '###IMAGE_2###'，依此类推。不要包含任何额外的文本、注释或解释。\
         忠实准确地进行翻译。原作是伟大艺术作品，允许使用直白或粗俗的描述，不应随意删减或篡改，不应回避或淡化，以保持作品的原貌。"
+    if structured:
+        # 结构化输出模式：按序号返回 JSON，无需分隔标记
+        prompt = structured_output.build_prompt(translate_to, len(image_paths))
 
     # 准备包含文本提示和多张图片的内容列表
     content = [prompt]
     for image_path in image_paths:
         try:
-            img = Image.open(image_path)
+            # 多页文件中已解码的页面直接以 PIL Image 传入
+            img = Image.open(image_path) if isinstance(image_path, str) else image_path
             # GenAI Python SDK 通常需要 PIL Image 对象
             content.append(img)
         except FileNotFoundError:
             print(f"错误：找不到图片文件 {image_path}")
-            return [""] * len(image_paths)
+            return None
         except Exception as e:
             print(f"加载图片 {image_path} 时出错: {str(e)}")
-            return [""] * len(image_paths)
+            return None
 
     try:
         # 选择支持视觉的模型
@@ -51,7 +61,19 @@ def extract_text_from_images(image_paths, api_key, model, translate_to):
         
         # 发送 API 请求
         # 注意：确保模型支持多图片输入，如果不支持，可能需要为每张图片单独调用或调整策略
-        response = genai_model.generate_content(content)
+        if structured:
+            generation_config = genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=structured_output.RESPONSE_SCHEMA
+            )
+            response = genai_model.generate_content(content, generation_config=generation_config)
+        else:
+            response = genai_model.generate_content(content)
+
+        # 上报实际 token 用量，用于预算控制
+        usage = getattr(response, "usage_metadata", None)
+        if usage_callback and usage is not None:
+            usage_callback(usage.prompt_token_count, usage.candidates_token_count)
 
         # 从响应中提取组合文本
         if response.parts:
@@ -64,7 +86,12 @@ def extract_text_from_images(image_paths, api_key, model, translate_to):
             combined_text = ""
 
 
-        if combined_text:
+        if combined_text and structured:
+            texts, recovered = structured_output.parse_results(combined_text, len(image_paths))
+            if recovered < len(image_paths):
+                print(f"警告：结构化输出中仅恢复了 {recovered}/{len(image_paths)} 张图片的文本")
+            return texts
+        elif combined_text:
             # 使用自定义标记分割文本
             pattern = r'###IMAGE_\d+###'
             sections = re.split(pattern, combined_text)
@@ -88,4 +115,4 @@ def extract_text_from_images(image_paths, api_key, model, translate_to):
     except Exception as e:
         # 捕获更具体的 GenAI 错误类型会更好，但 Exception 是一个通用回退
         print(f"GenAI API 调用期间发生错误: {str(e)}")
-        return [""] * len(image_paths)
+        return None
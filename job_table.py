@@ -0,0 +1,521 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# 批次状态
+STATUS_PENDING = 'pending'
+STATUS_LEASED = 'leased'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def default_worker_id():
+    """生成默认的工作节点标识：主机名-进程号。"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def make_job_key(input_dir, bind, job_name=''):
+    """
+    生成作业标识。
+
+    设置了 job_name 时，作业只由作业名称和批次大小确定，与输入目录的路径无关，
+    因此以不同路径挂载同一共享存储的节点也能加入同一个作业；
+    未设置时使用输入目录的绝对路径和批次大小。
+    """
+    if job_name:
+        return f"name={job_name}|bind={bind}"
+    return f"{os.path.realpath(input_dir)}|bind={bind}"
+
+
+class JobTable:
+    """
+    基于 SQLite 的共享作业表，用于多台机器之间无协调者地分摊批次。
+
+    各节点把同一份批次列表写入表中（重复写入会被忽略），然后通过租约领取批次：
+    领取后的批次在租约到期前归该节点所有，节点需定期发送心跳续约；
+    节点宕机后租约过期，其他节点即可重新领取。每张图片的结果以图片名为主键
+    写入结果表，因此即使同一批次被处理了两次，结果也只会提交一次。
+
+    同一个数据库可以容纳多个作业，作业由 job_key 区分（见 make_job_key），
+    所有批次、结果和节点统计都只在同一作业内共享。
+
+    作业表同时记录整个作业的 token 用量和各批次预留的预算额度，
+    使预算上限对所有节点共同生效（见 reserve_budget）。
+
+    数据库文件应放在所有节点都能访问的共享存储上。
+    """
+
+    def __init__(self, db_path, job_key='', lease_seconds=60, max_attempts=3):
+        """
+        参数:
+            db_path (str): SQLite 数据库文件路径。
+            job_key (str): 作业标识，见 make_job_key。
+            lease_seconds (int): 批次租约时长（秒）。
+            max_attempts (int): 单个批次最多尝试次数，超过后标记为失败。
+        """
+        self.db_path = db_path
+        self.job_key = job_key
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._init_schema()
+
+    def _connect(self):
+        # 每次操作使用独立连接，便于在多个线程中共享同一个 JobTable
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        try:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_key TEXT NOT NULL,
+                    batch_key TEXT NOT NULL,
+                    images TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    reserved_input INTEGER NOT NULL DEFAULT 0,
+                    reserved_output INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (job_key, batch_key)
+                );
+                CREATE TABLE IF NOT EXISTS results (
+                    job_key TEXT NOT NULL,
+                    image TEXT NOT NULL,
+                    batch_id INTEGER NOT NULL,
+                    text TEXT,
+                    worker_id TEXT NOT NULL,
+                    committed_at REAL NOT NULL,
+                    PRIMARY KEY (job_key, image)
+                );
+                CREATE TABLE IF NOT EXISTS workers (
+                    job_key TEXT NOT NULL,
+                    worker_id TEXT NOT NULL,
+                    host TEXT,
+                    started_at REAL NOT NULL,
+                    last_seen REAL NOT NULL,
+                    images_done INTEGER NOT NULL DEFAULT 0,
+                    batches_done INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (job_key, worker_id)
+                );
+                CREATE TABLE IF NOT EXISTS usage (
+                    job_key TEXT PRIMARY KEY,
+                    input_tokens INTEGER NOT NULL DEFAULT 0,
+                    output_tokens INTEGER NOT NULL DEFAULT 0
+                );
+            """)
+        finally:
+            conn.close()
+
+    def populate(self, batches):
+        """
+        将批次写入作业表。作业的批次列表只由第一个节点写入一次，之后即被固定：
+        后加入的节点直接使用表中已有的批次，不会按自己看到的目录内容重新切分，
+        因此节点启动之间目录中增删了文件也不会导致之后的图片被重复处理。
+
+        参数:
+            batches (list): 批次列表，每个批次是图片文件名的列表。
+
+        返回值:
+            int: 本次新写入的批次数量；作业已存在时为 0。
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            inserted = 0
+            exists = conn.execute(
+                "SELECT 1 FROM batches WHERE job_key = ? LIMIT 1", (self.job_key,)
+            ).fetchone()
+            for batch in ([] if exists else batches):
+                images = json.dumps(list(batch), ensure_ascii=False)
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO batches (job_key, batch_key, images) VALUES (?, ?, ?)",
+                    (self.job_key, images, images)
+                )
+                inserted += cur.rowcount
+            conn.execute("COMMIT")
+            return inserted
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def job_images(self):
+        """返回作业表中本作业的所有图片引用名（按批次顺序）。"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT images FROM batches WHERE job_key = ? ORDER BY batch_id", (self.job_key,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [image for (images,) in rows for image in json.loads(images)]
+
+    def register_worker(self, worker_id):
+        """登记工作节点，用于汇总吞吐量报告。"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO workers (job_key, worker_id, host, started_at, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(job_key, worker_id) DO UPDATE SET last_seen = excluded.last_seen",
+                (self.job_key, worker_id, socket.gethostname(), now, now)
+            )
+        finally:
+            conn.close()
+
+    def claim(self, worker_id):
+        """
+        领取一个待处理批次，或租约已过期的批次。
+
+        返回值:
+            tuple | None: (batch_id, 图片文件名列表)，没有可领取的批次时返回 None。
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT batch_id, images FROM batches "
+                "WHERE job_key = ? AND (status = ? OR (status = ? AND lease_expires < ?)) "
+                "ORDER BY batch_id LIMIT 1",
+                (self.job_key, STATUS_PENDING, STATUS_LEASED, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            batch_id, images = row
+            conn.execute(
+                "UPDATE batches SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                "reserved_input = 0, reserved_output = 0 WHERE batch_id = ?",
+                (STATUS_LEASED, worker_id, now + self.lease_seconds, batch_id)
+            )
+            conn.execute("COMMIT")
+            return batch_id, json.loads(images)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, worker_id):
+        """
+        为该节点持有的所有批次续约，并更新节点的最后活跃时间。
+
+        返回值:
+            int: 续约的批次数量。
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE batches SET lease_expires = ? WHERE job_key = ? AND owner = ? AND status = ?",
+                (now + self.lease_seconds, self.job_key, worker_id, STATUS_LEASED)
+            )
+            conn.execute("UPDATE workers SET last_seen = ? WHERE job_key = ? AND worker_id = ?",
+                         (now, self.job_key, worker_id))
+            return cur.rowcount
+        finally:
+            conn.close()
+
+    def commit_results(self, worker_id, batch_id, results):
+        """
+        提交一个批次的结果。每张图片只会被提交一次：若其他节点已提交过
+        同一张图片（例如租约过期后被重新领取），本次提交会被忽略。
+        文本为空的图片（空白页面或未检测到文本而跳过的图片）不写入结果表，批次照常标记为完成。
+
+        参数:
+            worker_id (str): 工作节点标识。
+            batch_id (int): 批次编号。
+            results (list): (图片文件名, 文本) 元组的列表。
+
+        返回值:
+            list: 本次实际提交成功的 (图片文件名, 文本) 列表。
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            committed = []
+            for image_file, text in results:
+                if not text or not text.strip():
+                    continue
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO results (job_key, image, batch_id, text, worker_id, committed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.job_key, image_file, batch_id, text, worker_id, now)
+                )
+                if cur.rowcount:
+                    committed.append((image_file, text))
+            conn.execute(
+                "UPDATE batches SET status = ?, owner = ?, lease_expires = NULL, "
+                "reserved_input = 0, reserved_output = 0 WHERE batch_id = ?",
+                (STATUS_DONE, worker_id, batch_id)
+            )
+            conn.execute(
+                "UPDATE workers SET last_seen = ?, images_done = images_done + ?, "
+                "batches_done = batches_done + ? WHERE job_key = ? AND worker_id = ?",
+                (now, len(committed), 1 if committed else 0, self.job_key, worker_id)
+            )
+            conn.execute("COMMIT")
+            return committed
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def release(self, worker_id, batch_id):
+        """
+        归还处理失败的批次，以便重试。超过最大尝试次数的批次标记为失败。
+
+        返回值:
+            bool: 批次是否已被标记为失败。
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT attempts FROM batches WHERE batch_id = ? AND owner = ? AND status = ?",
+                (batch_id, worker_id, STATUS_LEASED)
+            ).fetchone()
+            failed = False
+            if row is not None:
+                failed = row[0] >= self.max_attempts
+                conn.execute(
+                    "UPDATE batches SET status = ?, owner = NULL, lease_expires = NULL, "
+                    "reserved_input = 0, reserved_output = 0 WHERE batch_id = ?",
+                    (STATUS_FAILED if failed else STATUS_PENDING, batch_id)
+                )
+            conn.execute("COMMIT")
+            return failed
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def unclaim(self, worker_id, batch_id):
+        """归还尚未处理的批次（例如预算不足时），不计入尝试次数。"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE batches SET status = ?, owner = NULL, lease_expires = NULL, "
+                "attempts = MAX(attempts - 1, 0), reserved_input = 0, reserved_output = 0 "
+                "WHERE batch_id = ? AND owner = ? AND status = ?",
+                (STATUS_PENDING, batch_id, worker_id, STATUS_LEASED)
+            )
+        finally:
+            conn.close()
+
+    def _budget_usage(self, conn):
+        used = conn.execute(
+            "SELECT input_tokens, output_tokens FROM usage WHERE job_key = ?", (self.job_key,)
+        ).fetchone() or (0, 0)
+        # 只统计租约仍有效的预留额度，宕机节点的预留随租约过期自动失效
+        reserved = conn.execute(
+            "SELECT COALESCE(SUM(reserved_input), 0), COALESCE(SUM(reserved_output), 0) FROM batches "
+            "WHERE job_key = ? AND status = ? AND lease_expires >= ?",
+            (self.job_key, STATUS_LEASED, time.time())
+        ).fetchone()
+        return used[0], used[1], reserved[0], reserved[1]
+
+    def budget_usage(self):
+        """
+        返回整个作业的预算使用情况。
+
+        返回值:
+            tuple: (已用输入 token, 已用输出 token, 预留输入 token, 预留输出 token)。
+        """
+        conn = self._connect()
+        try:
+            return self._budget_usage(conn)
+        finally:
+            conn.close()
+
+    def reserve_budget(self, worker_id, batch_id, input_tokens, output_tokens, allows):
+        """
+        在同一事务中检查整个作业的预算并为已领取的批次预留额度，
+        因此多个节点同时预留时不会超出预算。
+
+        参数:
+            worker_id (str): 工作节点标识。
+            batch_id (int): 已领取的批次编号。
+            input_tokens (int): 预留的输入 token。
+            output_tokens (int): 预留的输出 token。
+            allows (callable): allows(输入 token, 输出 token) 判断总用量是否仍在预算之内。
+
+        返回值:
+            bool: 是否预留成功。
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            used_input, used_output, reserved_input, reserved_output = self._budget_usage(conn)
+            if not allows(used_input + reserved_input + input_tokens,
+                          used_output + reserved_output + output_tokens):
+                conn.execute("COMMIT")
+                return False
+            cur = conn.execute(
+                "UPDATE batches SET reserved_input = ?, reserved_output = ? "
+                "WHERE batch_id = ? AND owner = ? AND status = ?",
+                (input_tokens, output_tokens, batch_id, worker_id, STATUS_LEASED)
+            )
+            conn.execute("COMMIT")
+            return cur.rowcount > 0
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def record_usage(self, input_tokens, output_tokens):
+        """累加整个作业的实际 token 用量。"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO usage (job_key, input_tokens, output_tokens) VALUES (?, ?, ?) "
+                "ON CONFLICT(job_key) DO UPDATE SET input_tokens = input_tokens + excluded.input_tokens, "
+                "output_tokens = output_tokens + excluded.output_tokens",
+                (self.job_key, input_tokens or 0, output_tokens or 0)
+            )
+        finally:
+            conn.close()
+
+    def fetch_results(self, prefix):
+        """
+        读取所有以 prefix 开头的图片引用名的已提交结果。
+
+        返回值:
+            list: (图片引用名, 文本) 元组的列表。传入空字符串时返回本作业的所有结果。
+        """
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT image, text FROM results WHERE job_key = ? AND substr(image, 1, ?) = ?",
+                (self.job_key, len(prefix), prefix)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def finished_count(self):
+        """统计本作业中已完成或已放弃的批次包含的图片数，用于计算进度。"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT images FROM batches WHERE job_key = ? AND status IN (?, ?)",
+                (self.job_key, STATUS_DONE, STATUS_FAILED)
+            ).fetchall()
+        finally:
+            conn.close()
+        return sum(len(json.loads(images)) for (images,) in rows)
+
+    def remaining(self):
+        """返回尚未完成（待处理或已租出）的批次数量。"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM batches WHERE job_key = ? AND status IN (?, ?)",
+                (self.job_key, STATUS_PENDING, STATUS_LEASED)
+            ).fetchone()
+            return row[0]
+        finally:
+            conn.close()
+
+    def throughput_report(self):
+        """
+        汇总本作业所有节点的吞吐量。
+
+        返回值:
+            dict: 包含总图片数、批次状态统计、整体耗时与吞吐量，以及每个节点的明细。
+        """
+        conn = self._connect()
+        try:
+            status_counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM batches WHERE job_key = ? GROUP BY status", (self.job_key,)
+            ).fetchall())
+            workers = conn.execute(
+                "SELECT worker_id, host, started_at, last_seen, images_done, batches_done "
+                "FROM workers WHERE job_key = ? ORDER BY started_at", (self.job_key,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        per_worker = []
+        total_images = 0
+        start = None
+        end = None
+        for worker_id, host, started_at, last_seen, images_done, batches_done in workers:
+            elapsed = max(last_seen - started_at, 0.0)
+            per_worker.append({
+                'worker_id': worker_id,
+                'host': host,
+                'images': images_done,
+                'batches': batches_done,
+                'elapsed': elapsed,
+                'images_per_sec': images_done / elapsed if elapsed > 0 else 0.0,
+            })
+            total_images += images_done
+            start = started_at if start is None else min(start, started_at)
+            end = last_seen if end is None else max(end, last_seen)
+
+        elapsed = (end - start) if start is not None else 0.0
+        return {
+            'total_images': total_images,
+            'batches': status_counts,
+            'elapsed': elapsed,
+            'images_per_sec': total_images / elapsed if elapsed > 0 else 0.0,
+            'workers': per_worker,
+        }
+
+
+def format_throughput_report(report):
+    """将 throughput_report() 的结果格式化为多行文本。"""
+    batches = report['batches']
+    lines = [
+        f"集群吞吐量: 共 {len(report['workers'])} 个节点，{report['total_images']} 张图片，"
+        f"耗时 {report['elapsed']:.1f} 秒，{report['images_per_sec']:.2f} 张/秒",
+        f"批次状态: 完成 {batches.get(STATUS_DONE, 0)}，失败 {batches.get(STATUS_FAILED, 0)}，"
+        f"待处理 {batches.get(STATUS_PENDING, 0)}，处理中 {batches.get(STATUS_LEASED, 0)}",
+    ]
+    for worker in report['workers']:
+        lines.append(
+            f"  节点 {worker['worker_id']} ({worker['host']}): {worker['images']} 张图片，"
+            f"{worker['batches']} 批，{worker['images_per_sec']:.2f} 张/秒"
+        )
+    return "\n".join(lines)
+
+
+class LeaseHeartbeat:
+    """在后台线程中定期为工作节点持有的批次续约。"""
+
+    def __init__(self, table, worker_id, interval=None):
+        self.table = table
+        self.worker_id = worker_id
+        # 默认每隔三分之一租约时长续约一次
+        self.interval = interval if interval else max(table.lease_seconds / 3.0, 1.0)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.table.heartbeat(self.worker_id)
+            except Exception as e:
+                print(f"发送租约心跳时出错: {str(e)}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
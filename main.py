@@ -2,14 +2,21 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import yaml # 导入 yaml 库
 from pathlib import Path
 import concurrent.futures  # 添加并发处理库
 import functools # Added functools
+import threading
+import time
 
 # 导入新的客户端模块
 import openai_client
 import genai_client # 取消注释 GenAI 客户端导入
+import job_table # 分布式模式下的共享作业表
+import page_source # 多页文件的逐页读取
+import text_region # 上传前的文本区域检测与裁剪
+import planner # 预估与预算控制
 
 # Module-level logger function
 def log_output(message, logger_cb=None):
@@ -17,10 +24,67 @@ def log_output(message, logger_cb=None):
     if logger_cb:
         logger_cb(message)
 
+class ProgressReporter:
+    """
+    统计处理进度，并通过回调发送结构化的进度事件。
+
+    事件为 dict，包含: done (已处理图片数)、total (图片总数)、elapsed (已用秒数)、
+    rate (图片/秒) 与 eta (预计剩余秒数，无法估计时为 None)。
+    """
+
+    def __init__(self, total, callback=None):
+        self.total = total
+        self.callback = callback
+        self.done = 0
+        self.initial = 0
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+
+    def advance(self, count):
+        """增加已处理的图片数并发送进度事件。"""
+        with self._lock:
+            self.done += count
+            done = self.done
+        return self._emit(done)
+
+    def update(self, done):
+        """直接设置已处理的图片数（用于分布式模式下的集群进度）。"""
+        with self._lock:
+            self.done = done
+        return self._emit(done)
+
+    def rebase(self, total, done):
+        """
+        重新设定总数和已处理数（分布式模式下以作业表为准）。
+        速度只按之后处理的图片计算，不计入加入前其他节点已完成的部分。
+        """
+        with self._lock:
+            self.total = total
+            self.done = self.initial = done
+            self.start_time = time.time()
+        return self._emit(done)
+
+    def _emit(self, done):
+        elapsed = time.time() - self.start_time
+        rate = (done - self.initial) / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - done) / rate if rate > 0 and self.total >= done else None
+        event = {'done': done, 'total': self.total, 'elapsed': elapsed, 'rate': rate, 'eta': eta}
+        if self.callback:
+            try:
+                self.callback(event)
+            except Exception as e:
+                print(f"发送进度事件时出错: {str(e)}")
+        return event
+
+
 def process_directory(input_dir, output_dir, client_type,
                       openai_base_url, openai_api_key, openai_model,
                       genai_api_key, genai_model,
-                      bind=1, translate_to=None, max_workers=5, timeout=120, logger_callback=None):  # logger_callback is the parameter for this function
+                      bind=1, translate_to=None, max_workers=5, timeout=120, logger_callback=None,  # logger_callback is the parameter for this function
+                      job_db=None, lease_seconds=60, worker_id=None, pdf_rasterizer=None,
+                      text_region_mode=None, progress_callback=None, cancel_event=None,
+                      structured_output=False, budget_max_tokens=0, budget_max_cost=0, pricing=None,
+                      output_tokens_per_image=400, job_name=None):
     """
     处理输入目录中的所有图片，并将提取的文本保存到输出目录中。
 
@@ -38,95 +102,282 @@ def process_directory(input_dir, output_dir, client_type,
         max_workers (int): 并发处理的最大工作线程数 (默认为5)。
         timeout (int): API请求的超时时间（秒），默认120秒。
         logger_callback (callable): 可选的日志回调函数。
+        job_db (str): 可选的共享作业表（SQLite 数据库）路径。设置后进入分布式模式，
+            多个节点从同一作业表中按租约领取批次，每张图片的结果只提交一次。
+        lease_seconds (int): 分布式模式下批次租约时长（秒），默认60秒。
+        worker_id (str): 分布式模式下的节点标识，默认为“主机名-进程号”。
+        pdf_rasterizer (callable): 可选的 PDF 渲染器 rasterizer(path, first_page)，
+            逐页返回 PIL Image；为 None 时使用 page_source 中的默认渲染器。
+        text_region_mode (str): 可选的文本区域预处理模式。'crop' 裁掉空白边框，
+            'pack' 将文本区域拼接为紧凑的合成图；未检测到文本的图片将跳过 API 请求。
+        progress_callback (callable): 可选的进度回调函数，接收 ProgressReporter 生成的进度事件。
+        cancel_event (threading.Event): 可选的取消事件。被设置后不再提交新的批次，
+            等待进行中的批次完成后保存已完成的结果。
+        structured_output (bool): 是否使用结构化 JSON 输出（按序号返回每张图片的文本），
+            替代基于 '###IMAGE_N###' 分隔标记的文本拆分。
+        budget_max_tokens (int): token 预算上限，达到后不再提交新的批次，0 表示不限制。
+        budget_max_cost (float): 费用预算上限（美元），达到后不再提交新的批次，0 表示不限制。
+            模型没有已知价格时抛出 ValueError，不会开始处理。
+            分布式模式下预算由作业的所有节点共享，用量和预留额度记录在作业表中。
+        pricing (dict): 可选的模型价格表，见 planner.estimate_cost。
+        output_tokens_per_image (int): 预算控制中每张图片预计输出的 token 数。
+        job_name (str): 分布式模式下可选的作业名称。未设置时作业由输入目录的绝对路径和 bind 确定；
+            设置后只由作业名称和 bind 确定，各节点可以用不同路径挂载同一输入目录。
     """
     # 如果输出目录不存在，则创建它
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
-    # 支持的图片格式
-    image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp']
-
-    # 获取输入目录中的所有图片文件
+    # 获取输入目录中的所有图片文件（包括多页 TIFF/PDF 和动图 GIF）
+    supported_extensions = page_source.supported_extensions()
     image_files = [f for f in os.listdir(input_dir)
                    if os.path.isfile(os.path.join(input_dir, f)) and
-                   os.path.splitext(f)[1].lower() in image_extensions]
+                   os.path.splitext(f)[1].lower() in supported_extensions]
     
     # 按文件名排序以确保一致的处理顺序
     image_files.sort() 
 
+    if text_region_mode and text_region_mode not in text_region.MODES:
+        log_output(f"警告：不支持的文本区域模式 '{text_region_mode}'，已禁用文本区域检测", logger_cb=logger_callback)
+        text_region_mode = None
+    region_stats = text_region.TextRegionStats()
+
     selectModel = f"{openai_model if client_type == 'openai' else genai_model}"
-    log_output(f"找到 {len(image_files)} 张图片需要处理,调用 {client_type} : {selectModel}", logger_cb=logger_callback)
+    log_output(f"找到 {len(image_files)} 个图片文件需要处理,调用 {client_type} : {selectModel}", logger_cb=logger_callback)
+
+    budget_guard = planner.BudgetGuard(selectModel, budget_max_tokens, budget_max_cost, pricing)
+    if budget_max_cost and not budget_guard.cost_known():
+        # 未知价格时无法计算费用，继续处理会使费用上限失效
+        raise ValueError(f"未找到模型 {selectModel} 的价格，无法执行费用预算上限。"
+                         f"请在 pricing 中配置该模型的价格，或改用 budget_max_tokens")
+
+    # 只读取文件头统计页数，用于计算进度和剩余时间
+    total_pages = sum(page_source.count_pages(os.path.join(input_dir, f)) for f in image_files)
+    progress = ProgressReporter(total_pages, progress_callback)
+    progress.advance(0)
+
+    def is_cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    # 记录实测的请求耗时和速率限制，供之后的预估使用
+    throughput_stats = planner.ThroughputStats()
+
+    @functools.lru_cache(maxsize=None)
+    def file_page_sizes(image_file):
+        """每个文件只读取一次文件头，多页文件的各批次共享同一份页面尺寸。"""
+        try:
+            return page_source.page_sizes(os.path.join(input_dir, image_file))
+        except Exception:
+            return []
+
+    def estimate_batch(batch):
+        """只读取文件头估算批次的 (输入 token, 输出 token)。"""
+        sizes = []
+        for item in batch:
+            ref, page = item if isinstance(item, tuple) else (item, None)
+            if page is not None:
+                sizes.append(page.size)
+                continue
+            image_file, page_index = page_source.parse_page_ref(ref)
+            file_sizes = file_page_sizes(image_file)
+            if (page_index or 0) < len(file_sizes):
+                sizes.append(file_sizes[page_index or 0])
+        return planner.estimate_batch_tokens(client_type, selectModel, sizes, output_tokens_per_image)
 
     # 定义处理单个批次的函数
+    # batch 中的元素为 (引用名, 已解码页面或 None)，或者仅为引用名（分布式模式）
+    # 返回 (引用名, 文本) 列表，没有文本的图片对应空字符串；处理失败时返回 None
     def process_batch(batch_idx, batch):
-        batch_paths = [os.path.join(input_dir, img) for img in batch]
+        batch = [item if isinstance(item, tuple) else (item, None) for item in batch]
         log_output(f"正在处理第 {batch_idx + 1} 批，包含 {len(batch)} 张图片...", logger_cb=logger_callback)
 
         try:
+            batch_images = []
+            for ref, page in batch:
+                image_file, page_index = page_source.parse_page_ref(ref)
+                path = os.path.join(input_dir, image_file)
+                if page is None and page_index is not None:
+                    # 分布式模式下批次只包含引用名，需要按页码重新解码
+                    page = page_source.load_page(path, page_index, pdf_rasterizer)
+                # 普通图片直接传递文件路径，多页文件传递解码后的页面
+                batch_images.append(page if page is not None else path)
+
+            if text_region_mode:
+                # 上传前裁剪到文本区域，没有文本的图片不再发送请求
+                prepared = []
+                for ref, image in zip((ref for ref, _ in batch), batch_images):
+                    try:
+                        prepared.append(text_region.prepare_image(image, text_region_mode, region_stats))
+                    except Exception as e:
+                        log_output(f"检测图片 {ref} 的文本区域时出错，将上传原图: {str(e)}", logger_cb=logger_callback)
+                        prepared.append(image)
+                batch_images = prepared
+            send_indices = [j for j, image in enumerate(batch_images) if image is not None]
+            if not send_indices:
+                log_output(f"第 {batch_idx + 1} 批中的图片均未检测到文本，跳过 API 请求", logger_cb=logger_callback)
+                return [(ref, "") for ref, _ in batch]
+            batch_images = [batch_images[j] for j in send_indices]
+
+            # 记录实际 token 用量；服务端未返回用量时按预估值记账
+            usage = []
+
+            def record_usage(input_tokens, output_tokens):
+                usage.append((input_tokens, output_tokens))
+                budget_guard.record(input_tokens, output_tokens)
+
             extracted_texts = []
+            request_start = time.time()
             if client_type == 'openai':
                  # 调用 OpenAI 客户端函数
                 if not openai_api_key:
                     log_output("错误：OpenAI API 密钥未提供。", logger_cb=logger_callback)
-                    return []
+                    return None
                 extracted_texts = openai_client.extract_text_from_images(
-                    batch_paths, openai_base_url, openai_api_key, openai_model, translate_to
+                    batch_images, openai_base_url, openai_api_key, openai_model, translate_to,
+                    structured=structured_output, usage_callback=record_usage,
+                    rate_limit_callback=throughput_stats.record_rate_limits
                 )
             elif client_type == 'genai':
                 # 调用 GenAI 客户端函数
                 if not genai_api_key:
                     log_output("错误：GenAI API 密钥未提供。", logger_cb=logger_callback)
-                    return []
+                    return None
                 # 注意：GenAI 不需要 base_url
                 extracted_texts = genai_client.extract_text_from_images(
-                    batch_paths, genai_api_key, genai_model, translate_to
+                    batch_images, genai_api_key, genai_model, translate_to,
+                    structured=structured_output, usage_callback=record_usage
                 )
             else:
                 log_output(f"错误：不支持的客户端类型 '{client_type}'", logger_cb=logger_callback)
-                return []
+                return None
+            if extracted_texts is None:
+                # 客户端在读取图片或 API 请求失败时返回 None，与确实没有文本的图片区分
+                log_output(f"第 {batch_idx + 1} 批的 API 请求失败", logger_cb=logger_callback)
+                return None
+            throughput_stats.record_request(time.time() - request_start)
+            if budget_guard.enabled() and not usage:
+                budget_guard.record(*estimate_batch([batch[j] for j in send_indices]))
             
-            # 返回批次处理结果，包括图片文件名和提取的文本
+            # 返回批次处理结果，包括图片引用名和提取的文本
+            texts_by_index = dict(zip(send_indices, extracted_texts))
             results = []
-            for j, image_file in enumerate(batch):
-                if j < len(extracted_texts):  # 安全检查
-                    results.append((image_file, extracted_texts[j]))
+            for j, (image_file, _) in enumerate(batch):
+                if j in texts_by_index:  # 安全检查
+                    results.append((image_file, texts_by_index[j]))
+                elif j not in send_indices:
+                    # 未检测到文本而跳过的图片
+                    results.append((image_file, ""))
                 else:
                     log_output(f"警告：图片 {image_file} 的提取文本丢失。", logger_cb=logger_callback)
                     results.append((image_file, ""))
             return results
         except Exception as e:
             log_output(f"处理批处理时发生未捕获的错误: {str(e)}", logger_cb=logger_callback)
-            return []
+            return None
+
+    page_logger = lambda message: log_output(message, logger_cb=logger_callback)
 
-    # 创建批次
-    batches = []
-    for i in range(0, len(image_files), bind):
-        batches.append(image_files[i:i+bind])
-    
     # 使用线程池并发处理批次
     all_results = []
-    if batches: # Only proceed if there are batches to process
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有批次任务
-            future_to_batch = {executor.submit(process_batch, i, batch): (i, batch) 
-                               for i, batch in enumerate(batches)}
-            
-            # 处理完成的任务
-            for future in concurrent.futures.as_completed(future_to_batch):
-                i, batch = future_to_batch[future]
-                try:
-                    # 获取这个批次的结果
-                    results = future.result(timeout=timeout)
-                    all_results.extend(results)
-                    log_output(f"第 {i+1}/{len(batches)} 批处理完成", logger_cb=logger_callback)
-                except concurrent.futures.TimeoutError:
-                    log_output(f"第 {i+1} 批处理超时", logger_cb=logger_callback)
-                except Exception as e:
-                    log_output(f"处理第 {i+1} 批时发生错误: {str(e)}", logger_cb=logger_callback)
+    if job_db:
+        # 作业表中只保存引用名（只读取文件头统计页数），页面由领取批次的节点按页码解码
+        batches = list(page_source.iter_batches(page_source.iter_page_refs(input_dir, image_files, page_logger), bind))
+        job_key = job_table.make_job_key(input_dir, bind, job_name)
+        all_results = _process_batches_distributed(
+            batches, process_batch, estimate_batch, output_dir, job_db, job_key, lease_seconds, worker_id,
+            max_workers, logger_callback, progress, is_cancelled, budget_guard
+        )
     else:
-        log_output("没有图片批次需要处理。", logger_cb=logger_callback)
+        # 逐页展开输入文件并切分批次；多页文件只在批次被提交时才解码下一页
+        batch_stream = page_source.iter_batches(
+            page_source.iter_page_items(input_dir, image_files, pdf_rasterizer, page_logger), bind
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 限制同时在途的批次数量，避免一次性解码整个多页文件
+            max_in_flight = max_workers * 2
+            future_to_batch = {}
+            batch_iter = enumerate(batch_stream)
+            exhausted = False
+            submitted = 0
+            cancelled = False
+            budget_stopped = False
+            held_batch = None
+            while True:
+                if not cancelled and is_cancelled():
+                    cancelled = True
+                    # 撤销尚未开始执行的批次，只等待正在进行的批次完成
+                    for future in [f for f in future_to_batch if f.cancel()]:
+                        budget_guard.release(*future_to_batch.pop(future)[2])
+                    log_output("已取消：不再提交新的批次，等待进行中的批次完成...", logger_cb=logger_callback)
+                while (not cancelled and not budget_stopped and not exhausted and
+                       len(future_to_batch) < max_in_flight):
+                    next_batch = held_batch or next(batch_iter, None)
+                    held_batch = None
+                    if next_batch is None:
+                        exhausted = True
+                        break
+                    i, batch = next_batch
+                    estimate = (0, 0)
+                    if budget_guard.enabled():
+                        # 按预估用量预留预算；预留失败时先等待进行中的批次按实际用量结算
+                        estimate = estimate_batch(batch)
+                        if not budget_guard.try_reserve(*estimate):
+                            if future_to_batch:
+                                held_batch = next_batch
+                            else:
+                                budget_stopped = True
+                                log_output("已达到预算上限：不再提交新的批次", logger_cb=logger_callback)
+                            break
+                    future_to_batch[executor.submit(process_batch, i, batch)] = (i, batch, estimate)
+                    submitted += 1
+                if not future_to_batch:
+                    break
+
+                # 处理完成的任务
+                # 定期唤醒以便及时响应取消请求
+                done, _ = concurrent.futures.wait(
+                    future_to_batch, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    i, batch, estimate = future_to_batch.pop(future)
+                    budget_guard.release(*estimate)
+                    event = progress.advance(len(batch))
+                    try:
+                        # 获取这个批次的结果
+                        results = future.result(timeout=timeout)
+                        if results is None:
+                            log_output(f"第 {i+1} 批处理失败", logger_cb=logger_callback)
+                            continue
+                        all_results.extend(results)
+                        log_output(f"第 {i+1} 批处理完成（{event['done']}/{event['total']}）", logger_cb=logger_callback)
+                    except concurrent.futures.TimeoutError:
+                        log_output(f"第 {i+1} 批处理超时", logger_cb=logger_callback)
+                    except Exception as e:
+                        log_output(f"处理第 {i+1} 批时发生错误: {str(e)}", logger_cb=logger_callback)
+        if submitted == 0 and not cancelled and not budget_stopped:
+            log_output("没有图片批次需要处理。", logger_cb=logger_callback)
+
+    if is_cancelled():
+        log_output(f"处理已取消，保存已完成的 {len(all_results)} 张图片的结果", logger_cb=logger_callback)
+
+    if text_region_mode:
+        log_output(region_stats.summary(), logger_cb=logger_callback)
+    if budget_guard.enabled():
+        log_output(budget_guard.summary(), logger_cb=logger_callback)
+    try:
+        throughput_stats.save(os.path.join(output_dir, planner.STATS_FILE), selectModel)
+    except Exception as e:
+        log_output(f"保存吞吐量统计时出错: {str(e)}", logger_cb=logger_callback)
 
     # 处理并保存所有结果
-    for image_file, text in all_results:
+    _save_results(all_results, output_dir, logger_callback)
+
+
+def _save_results(results, output_dir, logger_callback=None):
+    """
+    将 (引用名, 文本) 结果写入输出目录。多页文件的所有页面写入同一个输出文件，每页一个分节。
+    """
+    singles, documents = page_source.group_pages(results)
+    for image_file, text in singles:
         # 只有当文本不为空时才保存文件
         if text and text.strip():  # 检查 text 是否为 None 或空字符串
             # 创建输出文件名（与输入文件名相同，但扩展名为 .txt）
@@ -139,6 +390,112 @@ def process_directory(input_dir, output_dir, client_type,
         else:
             log_output(f"图片 {image_file} 未提取到文本或提取失败，跳过保存", logger_cb=logger_callback)
 
+    # 多页文件的所有页面写入同一个输出文件，每页一个分节
+    for image_file, pages in documents.items():
+        if any(text and text.strip() for text in pages.values()):
+            base_name = os.path.splitext(image_file)[0]
+            output_file = os.path.join(output_dir, f"{base_name}.txt")
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(page_source.format_document(pages))
+        else:
+            log_output(f"文件 {image_file} 的所有页面均未提取到文本，跳过保存", logger_cb=logger_callback)
+
+
+def _process_batches_distributed(batches, process_batch, estimate_batch, output_dir, job_db, job_key, lease_seconds,
+                                 worker_id, max_workers, logger_callback, progress, is_cancelled, budget_guard):
+    """
+    分布式模式：从共享作业表中按租约领取批次并处理。
+
+    每个批次提交后立即写出对应的输出文件，因此节点中途宕机时已提交的结果不会丢失；
+    结束时返回作业表中所有已提交的结果，由调用方统一写出（包括其他已宕机节点提交的结果）。
+    """
+    table = job_table.JobTable(job_db, job_key, lease_seconds=lease_seconds)
+    worker_id = worker_id or job_table.default_worker_id()
+    if budget_guard.enabled():
+        # 预算由作业的所有节点共享：用量和预留都记录在作业表中
+        budget_guard.store = table
+    added = table.populate(batches)
+    table.register_worker(worker_id)
+    log_output(f"节点 {worker_id} 已加入作业表 {job_db}（作业 {job_key}），新增 {added} 批", logger_cb=logger_callback)
+    if added == 0 and set(table.job_images()) != {ref for batch in batches for ref in batch}:
+        log_output("警告：输入目录的内容与作业创建时不同，将按作业表中已有的批次处理；"
+                   "新增的文件不会被处理，如需处理请使用新的 job_name", logger_cb=logger_callback)
+    if added == 0 and table.remaining() == 0:
+        log_output("该作业的所有批次均已完成，不会重新处理；将从作业表写出已提交的结果。"
+                   "如需重新处理，请修改 job_name 或使用新的作业表", logger_cb=logger_callback)
+
+    # 没有可领取批次但仍有其他节点在处理时，等待一段时间再尝试（以便接管过期租约）
+    poll_interval = max(lease_seconds / 4.0, 1.0)
+
+    # 作业的批次列表以作业表为准，加入时其他节点可能已经完成了一部分
+    progress.rebase(len(table.job_images()), table.finished_count())
+
+    def worker_loop():
+        while not is_cancelled():
+            if budget_guard.exhausted():
+                log_output("已达到作业的预算上限：本节点不再领取新的批次", logger_cb=logger_callback)
+                return
+            claimed = table.claim(worker_id)
+            if claimed is None:
+                if table.remaining() == 0:
+                    return
+                time.sleep(poll_interval)
+                continue
+            batch_id, batch = claimed
+            if budget_guard.enabled() and not table.reserve_budget(
+                    worker_id, batch_id, *estimate_batch(batch), budget_guard.allows):
+                # 预留失败时先归还批次；其他批次仍在处理时等待它们按实际用量结算后再试
+                table.unclaim(worker_id, batch_id)
+                if any(table.budget_usage()[2:]):
+                    time.sleep(poll_interval)
+                    continue
+                log_output("已达到作业的预算上限：本节点不再领取新的批次", logger_cb=logger_callback)
+                return
+            results = process_batch(batch_id - 1, batch)
+            # 处理失败（如限流、连接或状态错误）时归还批次以便重试；
+            # 空白页面和未检测到文本而跳过的图片是正常结果，照常提交
+            if results is None:
+                if table.release(worker_id, batch_id):
+                    log_output(f"第 {batch_id} 批多次处理失败，已放弃", logger_cb=logger_callback)
+                else:
+                    log_output(f"第 {batch_id} 批处理失败，已归还以便重试", logger_cb=logger_callback)
+                # 进度按整个集群已完成或已放弃的批次中的页面数计算
+                progress.update(table.finished_count())
+                continue
+            committed = table.commit_results(worker_id, batch_id, results)
+            progress.update(table.finished_count())
+            extracted = sum(1 for _, text in results if text and text.strip())
+            if len(committed) < extracted:
+                log_output(f"第 {batch_id} 批中有 {extracted - len(committed)} 张图片已由其他节点提交，跳过",
+                           logger_cb=logger_callback)
+            _save_committed(table, committed, output_dir, logger_callback)
+            log_output(f"第 {batch_id} 批处理完成（剩余 {table.remaining()} 批）", logger_cb=logger_callback)
+
+    with job_table.LeaseHeartbeat(table, worker_id):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(worker_loop) for _ in range(max_workers)]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    log_output(f"分布式工作线程发生错误: {str(e)}", logger_cb=logger_callback)
+        table.heartbeat(worker_id)
+
+    log_output(job_table.format_throughput_report(table.throughput_report()), logger_cb=logger_callback)
+    # 返回所有节点已提交的结果，补写已宕机节点未能写出的文件
+    return table.fetch_results('')
+
+
+def _save_committed(table, committed, output_dir, logger_callback):
+    """立即写出刚提交的结果；多页文件的页面可能由不同节点处理，从作业表中补全已提交的所有页面。"""
+    results = list(committed)
+    _, documents = page_source.group_pages(committed)
+    committed_refs = {ref for ref, _ in committed}
+    for image_file in documents:
+        prefix = f"{image_file}{page_source.PAGE_SEPARATOR}"
+        results.extend((ref, text) for ref, text in table.fetch_results(prefix) if ref not in committed_refs)
+    _save_results(results, output_dir, logger_callback)
+
 
 def main():
     # 默认配置
@@ -155,7 +512,21 @@ def main():
         "clientType": "openai", # 指定使用哪个客户端 ('openai' 或 'genai')
         "proxy": "", # 添加代理默认配置
         "max_workers": 5,
-        "timeout": 30
+        "timeout": 30,
+        "job_db": "", # 共享作业表路径，留空则为单机模式
+        "lease_seconds": 60,
+        "worker_id": "",
+        "job_name": "", # 分布式作业名称，设置后代替输入目录路径标识作业
+        "text_region_mode": "", # 文本区域预处理模式 ('crop'、'pack' 或留空禁用)
+        "structured_output": False, # 是否使用结构化 JSON 输出
+        "dry_run": False, # 只输出预估结果，不实际处理
+        "budget_max_tokens": 0, # token 预算上限，0 表示不限制
+        "budget_max_cost": 0, # 费用预算上限（美元），0 表示不限制
+        "pricing": {}, # 模型价格表 {模型前缀: [输入价格, 输出价格]}（美元 / 百万 token）
+        "output_tokens_per_image": 400,
+        "seconds_per_request": 20,
+        "rate_limit_rpm": 0,
+        "rate_limit_tpm": 0
     }
 
     # 从 YAML 配置文件读取参数
@@ -187,6 +558,26 @@ def main():
         os.environ.pop("HTTPS_PROXY", None)
         log_output("未配置代理，将使用系统代理设置（如果存在）。")
 
+    # 预估 token、费用和耗时（只读取图片文件头）；只在预估模式或设置了预算时执行
+    dry_run = config.get("dry_run") or "--plan" in sys.argv[1:]
+    budgeted = config["budget_max_tokens"] or config["budget_max_cost"]
+    selected_model = config["openai_model"] if config.get("clientType") == "openai" else config["genai_model"]
+    if dry_run or budgeted:
+        try:
+            plan = planner.plan_directory(
+                config["input"], config["clientType"], selected_model, config["bind"], config["max_workers"],
+                pricing=config["pricing"],
+                output_tokens_per_image=config["output_tokens_per_image"],
+                seconds_per_request=config["seconds_per_request"],
+                rate_limit_rpm=config["rate_limit_rpm"],
+                rate_limit_tpm=config["rate_limit_tpm"],
+                observed=planner.load_stats(os.path.join(config["output"], planner.STATS_FILE), selected_model)
+            )
+            log_output(planner.format_plan(plan))
+        except Exception as e:
+            log_output(f"预估处理量时发生错误: {str(e)}")
+    if dry_run:
+        return
 
     # 检查所选客户端的 API 密钥是否存在
     selected_client = config.get("clientType", "openai")
@@ -211,6 +602,13 @@ def main():
              log_output(f"错误：无法确定所需的 API 密钥，因为 clientType '{selected_client}' 无效。")
         return # 缺少 API 密钥则退出
 
+    # 设置了费用上限但模型没有已知价格时，无法控制费用
+    if config["budget_max_cost"] and not planner.BudgetGuard(
+            selected_model, max_cost=config["budget_max_cost"], pricing=config["pricing"]).cost_known():
+        log_output(f"错误：未找到模型 {selected_model} 的价格，无法执行费用预算上限。"
+                   f"请在 config.yaml 的 pricing 中配置该模型的价格，或改用 budget_max_tokens")
+        return
+
     # 处理目录 (不再传递 proxy 参数)
     # When main() calls process_directory, it doesn't have a GUI logger, so logger_callback is None
     process_directory(
@@ -226,7 +624,17 @@ def main():
         config["translateTo"],
         config["max_workers"],
         config["timeout"],
-        logger_callback=None # Explicitly passing None as main() doesn't have a GUI callback
+        logger_callback=None, # Explicitly passing None as main() doesn't have a GUI callback
+        job_db=config["job_db"] or None,
+        lease_seconds=config["lease_seconds"],
+        worker_id=config["worker_id"] or None,
+        job_name=config["job_name"] or None,
+        text_region_mode=config["text_region_mode"] or None,
+        structured_output=bool(config["structured_output"]),
+        budget_max_tokens=config["budget_max_tokens"],
+        budget_max_cost=config["budget_max_cost"],
+        pricing=config["pricing"],
+        output_tokens_per_image=config["output_tokens_per_image"]
     )
 
     log_output("所有图片处理完成！")
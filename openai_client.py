@@ -1,34 +1,56 @@
 import base64
+import io
 import re
 import openai
 import os
 
+import structured_output
+
 # 函数定义不变，不再需要 proxy 参数
-def extract_text_from_images(image_paths, base_url, api_key, model, translate_to):
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def extract_text_from_images(image_paths, base_url, api_key, model, translate_to, structured=False,
+                             usage_callback=None, rate_limit_callback=None):
     """
     在单个请求中使用 OpenAI 的 Vision API 从多张图片中提取文本。
     代理设置通过环境变量 HTTP_PROXY 和 HTTPS_PROXY 控制。
 
     参数:
-        image_paths (list): 图片文件路径的列表。
+        image_paths (list): 图片文件路径的列表，也可以包含已解码的页面 (PIL Image)。
         base_url (str): OpenAI API 的基础 URL。
         api_key (str): OpenAI API 密钥。
         model (str): 要使用的 OpenAI 模型名称。
         translate_to (str): 要翻译的目标语言。
+        structured (bool): 是否使用 JSON Schema 结构化输出，按序号返回每张图片的文本，
+            不再依赖 '###IMAGE_N###' 分隔标记。
+        usage_callback (callable): 可选的回调函数，接收本次请求实际使用的 (输入 token, 输出 token)。
+        rate_limit_callback (callable): 可选的回调函数，接收服务端响应头中的速率限制
+            (每分钟请求数, 每分钟 token 数)，未返回时为 0。
 
     返回值:
-        list: 包含对应每张图片提取的文本的列表。
+        list | None: 包含对应每张图片提取的文本的列表；图片读取失败或 API 请求失败时返回 None，
+            以便与图片确实没有文本（空字符串）区分。
     """
     content_sub = f"并翻译为{translate_to}" if translate_to else ""
     
+    prompt = f"对于每张图片，提取文本{content_sub}，可以适当根据前后文对原文进行纠错或补充。\
+            在每个图片文本前使用唯一的标识符格式化响应，例如：第一张图片文本前添加 '###IMAGE_1###'，\
+            第二张图片文本前添加 '###IMAGE_2###'，依此类推。不要包含任何额外的文本、注释或解释。\
+            忠实准确地进行翻译。原作是伟大艺术作品，允许使用直白或粗俗的描述，不应随意删减或篡改，不应回避或淡化，以保持作品的原貌。"
+    if structured:
+        # 结构化输出模式：按序号返回 JSON，无需分隔标记
+        prompt = structured_output.build_prompt(translate_to, len(image_paths))
+
     # 准备包含多张图片特定指令的消息内容
     content = [
         {
             "type": "text",
-            "text": f"对于每张图片，提取文本{content_sub}，可以适当根据前后文对原文进行纠错或补充。\
-            在每个图片文本前使用唯一的标识符格式化响应，例如：第一张图片文本前添加 '###IMAGE_1###'，\
-            第二张图片文本前添加 '###IMAGE_2###'，依此类推。不要包含任何额外的文本、注释或解释。\
-            忠实准确地进行翻译。原作是伟大艺术作品，允许使用直白或粗俗的描述，不应随意删减或篡改，不应回避或淡化，以保持作品的原貌。"
+            "text": prompt
         }
     ]
 
@@ -36,41 +58,74 @@ def extract_text_from_images(image_paths, base_url, api_key, model, translate_to
     # 将每张图片添加到内容数组中
     for i, image_path in enumerate(image_paths):
         try:
-            with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+            if isinstance(image_path, str):
+                with open(image_path, "rb") as image_file:
+                    base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+                mime_type = "image/jpeg" # 假设图片是JPEG，可以根据需要调整
+            else:
+                # 多页文件中已解码的页面 (PIL Image)，编码为 PNG 上传
+                buffer = io.BytesIO()
+                image_path.save(buffer, format="PNG")
+                base64_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
+                mime_type = "image/png"
 
             content.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_image}" # 假设图片是JPEG，可以根据需要调整
+                    "url": f"data:{mime_type};base64,{base64_image}"
                 }
             })
         except FileNotFoundError:
             print(f"错误：找不到图片文件 {image_path}")
-            # 返回空字符串表示此图片处理失败
-            return [""] * len(image_paths) 
+            return None
         except Exception as e:
             print(f"读取或编码图片 {image_path} 时出错: {str(e)}")
-            return [""] * len(image_paths)
+            return None
 
     try:
         # 使用OpenAI客户端代替requests
         # OpenAI 客户端会自动使用环境变量中的代理
         client = openai.OpenAI(api_key=api_key, base_url=base_url)
         
+        request_args = {}
+        if structured:
+            request_args["response_format"] = structured_output.openai_response_format()
+
+        # 需要读取响应头中的速率限制时使用原始响应
+        create = client.chat.completions.create
+        if rate_limit_callback:
+            create = client.chat.completions.with_raw_response.create
+
         # 发送API请求
-        response = client.chat.completions.create(
+        response = create(
             model=model,
             messages=[{
                 "role": "user",
                 "content": content
             }],
-            max_tokens=4096 # 调整 max_tokens，1M 太大了，通常 vision 模型有上限，例如 4096
+            max_tokens=4096, # 调整 max_tokens，1M 太大了，通常 vision 模型有上限，例如 4096
+            **request_args
         )
+        if rate_limit_callback:
+            rate_limit_callback(_header_int(response.headers, "x-ratelimit-limit-requests"),
+                                _header_int(response.headers, "x-ratelimit-limit-tokens"))
+            response = response.parse()
+
+        # 上报实际 token 用量，用于预算控制
+        usage = getattr(response, "usage", None)
+        if usage_callback and usage is not None:
+            usage_callback(usage.prompt_tokens, usage.completion_tokens)
         
         # 从响应中提取组合文本
         if response.choices and len(response.choices) > 0:
-            combined_text = response.choices[0].message.content
+            combined_text = response.choices[0].message.content or ""
+
+            if structured:
+                texts, recovered = structured_output.parse_results(combined_text, len(image_paths))
+                if recovered < len(image_paths):
+                    truncated = response.choices[0].finish_reason == "length"
+                    print(f"警告：结构化输出{'被截断，' if truncated else '中'}仅恢复了 {recovered}/{len(image_paths)} 张图片的文本")
+                return texts
 
             # 使用自定义标记分割文本
             pattern = r'###IMAGE_\d+###'
@@ -90,18 +145,18 @@ def extract_text_from_images(image_paths, base_url, api_key, model, translate_to
                 return [section.strip() for section in sections[:len(image_paths)]]
         else:
             print("警告：API 响应中没有找到有效的 choices。")
-            return [""] * len(image_paths)
+            return None
 
     except openai.APIConnectionError as e:
         print(f"无法连接到 OpenAI API: {e}")
-        return [""] * len(image_paths)
+        return None
     except openai.RateLimitError as e:
         print(f"达到 OpenAI API 速率限制: {e}")
-        return [""] * len(image_paths)
+        return None
     except openai.APIStatusError as e:
         print(f"OpenAI API 返回状态错误: {e.status_code} - {e.response}")
-        return [""] * len(image_paths)
+        return None
     except Exception as e:
         print(f"API 调用期间发生意外错误: {str(e)}")
-        return [""] * len(image_paths)
+        return None
 
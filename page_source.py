@@ -0,0 +1,297 @@
+import itertools
+import os
+from PIL import Image, ImageSequence
+
+# 单页图片格式（直接按文件上传）
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp']
+# 可能包含多页/多帧的容器格式（逐页解码后上传）
+MULTI_PAGE_EXTENSIONS = ['.gif', '.tif', '.tiff', '.pdf']
+
+# 页面引用的分隔符，例如 "doc.tiff#page3" 表示 doc.tiff 的第 3 页
+PAGE_SEPARATOR = '#page'
+
+# PDF 渲染分辨率
+PDF_DPI = 200
+
+
+def supported_extensions():
+    """返回输入目录中可以处理的所有文件扩展名。"""
+    return sorted(set(IMAGE_EXTENSIONS) | set(MULTI_PAGE_EXTENSIONS))
+
+
+def page_ref(image_file, page_index):
+    """生成页面引用名，page_index 从 0 开始，引用名中的页码从 1 开始。"""
+    return f"{image_file}{PAGE_SEPARATOR}{page_index + 1}"
+
+
+def parse_page_ref(ref):
+    """
+    解析页面引用名。
+
+    返回值:
+        tuple: (文件名, 页索引)；普通图片的页索引为 None。
+    """
+    image_file, sep, page = ref.rpartition(PAGE_SEPARATOR)
+    if (sep and page.isdigit() and
+            os.path.splitext(image_file)[1].lower() in MULTI_PAGE_EXTENSIONS):
+        return image_file, int(page) - 1
+    return ref, None
+
+
+def pdfium_rasterizer(path, first_page=0):
+    """使用 pypdfium2 逐页渲染 PDF，每次只渲染一页。"""
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(path)
+    try:
+        for index in range(first_page, len(pdf)):
+            page = pdf[index]
+            try:
+                yield page.render(scale=PDF_DPI / 72).to_pil().convert('RGB')
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+
+
+def pymupdf_rasterizer(path, first_page=0):
+    """使用 PyMuPDF 逐页渲染 PDF，每次只渲染一页。"""
+    import fitz
+    doc = fitz.open(path)
+    try:
+        for index in range(first_page, doc.page_count):
+            pix = doc[index].get_pixmap(dpi=PDF_DPI, alpha=False)
+            yield Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+    finally:
+        doc.close()
+
+
+def get_default_pdf_rasterizer():
+    """
+    返回可用的默认 PDF 渲染器（优先 pypdfium2，其次 PyMuPDF），都未安装时返回 None。
+
+    渲染器是一个可调用对象 rasterizer(path, first_page=0)，
+    返回从 first_page 开始逐页生成 PIL Image 的迭代器。
+    """
+    try:
+        import pypdfium2  # noqa: F401
+        return pdfium_rasterizer
+    except ImportError:
+        pass
+    try:
+        import fitz  # noqa: F401
+        return pymupdf_rasterizer
+    except ImportError:
+        return None
+
+
+def _is_multi_page(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.pdf':
+        return True
+    if ext in ('.tif', '.tiff'):
+        # TIFF 即使只有一页也需要解码后上传
+        return True
+    if ext == '.gif':
+        with Image.open(path) as img:
+            return getattr(img, 'is_animated', False)
+    return False
+
+
+def count_pages(path):
+    """
+    只读取文件头统计页数（不解码图像数据），无法确定时返回 1。
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == '.pdf':
+            try:
+                import pypdfium2 as pdfium
+                pdf = pdfium.PdfDocument(path)
+                try:
+                    return len(pdf)
+                finally:
+                    pdf.close()
+            except ImportError:
+                import fitz
+                with fitz.open(path) as doc:
+                    return doc.page_count
+        if ext in MULTI_PAGE_EXTENSIONS:
+            with Image.open(path) as img:
+                return getattr(img, 'n_frames', 1)
+    except Exception:
+        pass
+    return 1
+
+
+def page_sizes(path):
+    """
+    只读取文件头获取每一页的像素尺寸 (宽, 高)，不解码图像数据。
+
+    PDF 页面按 PDF_DPI 渲染后的尺寸计算；没有可用的 PDF 库时返回空列表。
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.pdf':
+        scale = PDF_DPI / 72.0
+        try:
+            import pypdfium2 as pdfium
+            pdf = pdfium.PdfDocument(path)
+            try:
+                return [(int(w * scale), int(h * scale))
+                        for w, h in (pdf.get_page_size(i) for i in range(len(pdf)))]
+            finally:
+                pdf.close()
+        except ImportError:
+            pass
+        try:
+            import fitz
+        except ImportError:
+            return []
+        with fitz.open(path) as doc:
+            return [(int(page.rect.width * scale), int(page.rect.height * scale)) for page in doc]
+
+    with Image.open(path) as img:
+        if ext in ('.tif', '.tiff'):
+            # TIFF 的 seek 只读取每一页的 IFD 头
+            sizes = []
+            for index in range(getattr(img, 'n_frames', 1)):
+                img.seek(index)
+                sizes.append(img.size)
+            return sizes
+        if ext == '.gif':
+            # GIF 的所有帧共享同一画布尺寸
+            return [img.size] * getattr(img, 'n_frames', 1)
+        return [img.size]
+
+
+def iter_pages(path, pdf_rasterizer=None, first_page=0):
+    """
+    惰性地逐页解码多页文件，每次只在内存中保留一页。
+
+    参数:
+        path (str): 文件路径。
+        pdf_rasterizer (callable): PDF 渲染器，为 None 时使用默认渲染器。
+        first_page (int): 起始页索引（从 0 开始）。
+
+    返回值:
+        iterator: 逐页生成 (页索引, PIL Image)。
+    """
+    if os.path.splitext(path)[1].lower() == '.pdf':
+        rasterizer = pdf_rasterizer or get_default_pdf_rasterizer()
+        if rasterizer is None:
+            raise RuntimeError("未找到可用的 PDF 渲染器，请安装 pypdfium2 或 PyMuPDF")
+        for index, page in enumerate(rasterizer(path, first_page), start=first_page):
+            yield index, page
+        return
+
+    with Image.open(path) as img:
+        frames = ImageSequence.Iterator(img)
+        for index, frame in enumerate(itertools.islice(frames, first_page, None), start=first_page):
+            # convert 会复制当前帧，之后文件句柄可以安全地继续前进
+            yield index, frame.convert('RGB')
+
+
+def load_page(path, page_index, pdf_rasterizer=None):
+    """
+    按索引加载多页文件中的单页。
+
+    TIFF 通过 seek 直接定位到该页的 IFD，不解码之前的页面；PDF 由渲染器从该页开始渲染。
+    """
+    if os.path.splitext(path)[1].lower() == '.pdf':
+        for _, page in iter_pages(path, pdf_rasterizer, first_page=page_index):
+            return page
+        raise IndexError(f"{path} 中不存在第 {page_index + 1} 页")
+
+    with Image.open(path) as img:
+        try:
+            img.seek(page_index)
+        except EOFError:
+            raise IndexError(f"{path} 中不存在第 {page_index + 1} 页")
+        return img.convert('RGB')
+
+
+def iter_page_items(input_dir, image_files, pdf_rasterizer=None, logger=print):
+    """
+    将输入文件展开为逐页的处理单元流。
+
+    普通图片生成 (文件名, None)，由客户端直接读取文件；
+    多页文件按页生成 (页面引用名, PIL Image)，只有在被消费时才解码下一页。
+
+    参数:
+        input_dir (str): 输入目录。
+        image_files (list): 输入目录中的文件名列表。
+        pdf_rasterizer (callable): 可选的 PDF 渲染器。
+        logger (callable): 日志函数。
+    """
+    for image_file in image_files:
+        path = os.path.join(input_dir, image_file)
+        try:
+            if not _is_multi_page(path):
+                yield image_file, None
+                continue
+            for index, page in iter_pages(path, pdf_rasterizer):
+                yield page_ref(image_file, index), page
+        except Exception as e:
+            logger(f"读取多页文件 {image_file} 时出错，已跳过剩余页面: {str(e)}")
+
+
+def iter_page_refs(input_dir, image_files, logger=print):
+    """
+    只读取文件头，将输入文件展开为逐页的引用名，不解码任何页面。
+
+    分布式模式下作业表只保存引用名，页面由领取批次的节点通过 load_page 解码。
+
+    参数:
+        input_dir (str): 输入目录。
+        image_files (list): 输入目录中的文件名列表。
+        logger (callable): 日志函数。
+    """
+    for image_file in image_files:
+        path = os.path.join(input_dir, image_file)
+        try:
+            if not _is_multi_page(path):
+                yield image_file
+                continue
+            for index in range(count_pages(path)):
+                yield page_ref(image_file, index)
+        except Exception as e:
+            logger(f"读取多页文件 {image_file} 时出错，已跳过: {str(e)}")
+
+
+def iter_batches(items, bind):
+    """将处理单元流按 bind 大小切分为批次，不会预先读取整个流。"""
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, bind))
+        if not batch:
+            return
+        yield batch
+
+
+def group_pages(results):
+    """
+    将结果按源文件分组。
+
+    参数:
+        results (list): (引用名, 文本) 元组的列表。
+
+    返回值:
+        tuple: (普通图片结果列表, {多页文件名: {页索引: 文本}})。
+    """
+    singles = []
+    documents = {}
+    for ref, text in results:
+        image_file, page_index = parse_page_ref(ref)
+        if page_index is None:
+            singles.append((image_file, text))
+        else:
+            documents.setdefault(image_file, {})[page_index] = text
+    return singles, documents
+
+
+def format_document(pages):
+    """将多页文件的逐页文本合并为一个带分页标题的文本。"""
+    sections = []
+    for page_index in sorted(pages):
+        text = (pages[page_index] or '').strip()
+        sections.append(f"===== 第 {page_index + 1} 页 =====\n{text}")
+    return "\n\n".join(sections)
@@ -0,0 +1,367 @@
+import json
+import math
+import os
+import threading
+import time
+
+import page_source
+
+# 各模型的价格（美元 / 百万 token）：(输入, 输出)。可在 config.yaml 的 pricing 中覆盖或补充
+DEFAULT_PRICING = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4.1': (2.00, 8.00),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gemini-2.0-flash': (0.10, 0.40),
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-1.5-pro': (1.25, 5.00),
+}
+
+# OpenAI 高精度图片按 512x512 切块计费：(基础 token, 每块 token)
+OPENAI_TILE_TOKENS = {
+    'gpt-4o-mini': (2833, 5667),
+}
+OPENAI_DEFAULT_TILE_TOKENS = (85, 170)
+
+# Gemini 每张图片（或每个 768x768 切块）计 258 token
+GENAI_TOKENS_PER_TILE = 258
+
+# 实测吞吐量统计文件（保存在输出目录中），之后的预估优先使用其中的实测值
+STATS_FILE = 'aiocr_stats.json'
+
+# 每次请求中提示词占用的 token 数（估算值）
+PROMPT_TOKENS = 300
+# 客户端请求中设置的 max_tokens
+MAX_OUTPUT_TOKENS = 4096
+
+
+def _lookup(table, model, default=None):
+    """按最长前缀匹配模型名，例如 'gpt-4o-2024-08-06' 匹配 'gpt-4o'。"""
+    model = (model or '').lower()
+    matches = [key for key in table if model.startswith(key.lower())]
+    if not matches:
+        return default
+    return table[max(matches, key=len)]
+
+
+def estimate_image_tokens(client_type, model, width, height):
+    """
+    按各服务商公开的计费规则估算单张图片的输入 token 数。
+
+    参数:
+        client_type (str): 'openai' 或 'genai'。
+        model (str): 模型名称。
+        width (int): 图片宽度（像素）。
+        height (int): 图片高度（像素）。
+    """
+    if width <= 0 or height <= 0:
+        return 0
+    if client_type == 'genai':
+        if (model or '').startswith('gemini-1.5') or (width <= 384 and height <= 384):
+            return GENAI_TOKENS_PER_TILE
+        return math.ceil(width / 768) * math.ceil(height / 768) * GENAI_TOKENS_PER_TILE
+
+    # OpenAI：先缩放到 2048x2048 以内，再将短边缩放到 768，然后按 512x512 切块
+    base, per_tile = _lookup(OPENAI_TILE_TOKENS, model, OPENAI_DEFAULT_TILE_TOKENS)
+    scale = min(1.0, 2048.0 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768.0 / min(width, height))
+    width, height = width * scale, height * scale
+    return base + per_tile * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def estimate_cost(model, input_tokens, output_tokens, pricing=None):
+    """
+    估算费用（美元），未知模型价格时返回 None。
+
+    参数:
+        pricing (dict): 可选的价格表 {模型前缀: [输入价格, 输出价格]}，单位为美元 / 百万 token。
+    """
+    table = dict(DEFAULT_PRICING)
+    if pricing:
+        table.update({key: tuple(value) for key, value in pricing.items()})
+    price = _lookup(table, model)
+    if price is None:
+        return None
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1000000.0
+
+
+def estimate_batch_tokens(client_type, model, sizes, output_tokens_per_image):
+    """估算一个批次请求的 (输入 token, 输出 token)。"""
+    input_tokens = PROMPT_TOKENS + sum(estimate_image_tokens(client_type, model, w, h) for w, h in sizes)
+    output_tokens = min(len(sizes) * output_tokens_per_image, MAX_OUTPUT_TOKENS)
+    return input_tokens, output_tokens
+
+
+def plan_directory(input_dir, client_type, model, bind, max_workers,
+                   pricing=None, output_tokens_per_image=400, seconds_per_request=20,
+                   rate_limit_rpm=0, rate_limit_tpm=0, observed=None):
+    """
+    预估处理整个输入目录所需的 token、费用和耗时（只读取图片文件头，不解码图像）。
+
+    耗时优先使用之前运行中实测的单次请求耗时和服务端返回的速率限制（见 ThroughputStats），
+    没有实测值时使用配置值。
+
+    参数:
+        input_dir (str): 输入目录。
+        client_type (str): 'openai' 或 'genai'。
+        model (str): 模型名称。
+        bind (int): 每次请求处理的图片数量。
+        max_workers (int): 并发线程数。
+        pricing (dict): 可选的价格表，见 estimate_cost。
+        output_tokens_per_image (int): 每张图片预计输出的 token 数。
+        seconds_per_request (float): 单次请求的平均耗时（秒）。
+        rate_limit_rpm (int): 每分钟请求数上限，0 表示不限制。
+        rate_limit_tpm (int): 每分钟 token 数上限，0 表示不限制。
+        observed (dict): 可选的实测值，见 load_stats。
+
+    返回值:
+        dict: 预估结果。
+    """
+    observed = observed or {}
+    latency_source = 'observed' if observed.get('seconds_per_request') else 'configured'
+    seconds_per_request = observed.get('seconds_per_request') or seconds_per_request
+    limits_source = 'observed' if observed.get('rate_limit_rpm') or observed.get('rate_limit_tpm') else 'configured'
+    rate_limit_rpm = observed.get('rate_limit_rpm') or rate_limit_rpm
+    rate_limit_tpm = observed.get('rate_limit_tpm') or rate_limit_tpm
+
+    supported_extensions = page_source.supported_extensions()
+    image_files = sorted(f for f in os.listdir(input_dir)
+                         if os.path.isfile(os.path.join(input_dir, f)) and
+                         os.path.splitext(f)[1].lower() in supported_extensions)
+
+    sizes = []
+    unreadable = 0
+    for image_file in image_files:
+        try:
+            file_sizes = page_source.page_sizes(os.path.join(input_dir, image_file))
+        except Exception:
+            file_sizes = []
+        if not file_sizes:
+            unreadable += 1
+        sizes.extend(file_sizes)
+
+    bind = max(1, bind)
+    input_tokens = 0
+    output_tokens = 0
+    requests = 0
+    # 批次在文件之间连续切分，与 process_directory 的切分方式一致
+    for i in range(0, len(sizes), bind):
+        batch_input, batch_output = estimate_batch_tokens(
+            client_type, model, sizes[i:i + bind], output_tokens_per_image
+        )
+        input_tokens += batch_input
+        output_tokens += batch_output
+        requests += 1
+
+    total_tokens = input_tokens + output_tokens
+    wall_times = [requests * seconds_per_request / float(max(1, max_workers))]
+    if rate_limit_rpm:
+        wall_times.append(requests / float(rate_limit_rpm) * 60)
+    if rate_limit_tpm:
+        wall_times.append(total_tokens / float(rate_limit_tpm) * 60)
+
+    return {
+        'files': len(image_files),
+        'images': len(sizes),
+        'unreadable': unreadable,
+        'requests': requests,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'total_tokens': total_tokens,
+        'cost': estimate_cost(model, input_tokens, output_tokens, pricing),
+        'seconds': max(wall_times),
+        'model': model,
+        'client_type': client_type,
+        'seconds_per_request': seconds_per_request,
+        'latency_source': latency_source,
+        'observed_requests': observed.get('requests', 0),
+        'rate_limit_rpm': rate_limit_rpm,
+        'rate_limit_tpm': rate_limit_tpm,
+        'limits_source': limits_source,
+    }
+
+
+def format_plan(plan):
+    """将 plan_directory() 的结果格式化为多行文本。"""
+    seconds = int(plan['seconds'])
+    cost = f"${plan['cost']:.2f}" if plan['cost'] is not None else "未知（请在 config.yaml 的 pricing 中配置模型价格）"
+    lines = [
+        f"预估（{plan['client_type']} : {plan['model']}）: {plan['files']} 个文件，{plan['images']} 张图片，"
+        f"{plan['requests']} 次请求",
+        f"  token: 输入 {plan['input_tokens']}，输出约 {plan['output_tokens']}，合计 {plan['total_tokens']}",
+        f"  费用: {cost}",
+        f"  耗时: 约 {seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}",
+    ]
+    if plan['latency_source'] == 'observed':
+        latency = f"实测 {plan['seconds_per_request']:.1f} 秒/请求（{plan['observed_requests']} 次请求）"
+    else:
+        latency = f"配置 {plan['seconds_per_request']} 秒/请求（尚无实测数据）"
+    limits = "不限" if not (plan['rate_limit_rpm'] or plan['rate_limit_tpm']) else (
+        f"{'实测' if plan['limits_source'] == 'observed' else '配置'} "
+        f"{plan['rate_limit_rpm'] or '-'} 请求/分钟，{plan['rate_limit_tpm'] or '-'} token/分钟")
+    lines.append(f"  耗时依据: {latency}；速率限制: {limits}")
+    if plan['unreadable']:
+        lines.append(f"  警告：{plan['unreadable']} 个文件无法读取尺寸，未计入预估")
+    return "\n".join(lines)
+
+
+class ThroughputStats:
+    """线程安全地记录实际请求的耗时和服务端返回的速率限制，供之后的预估使用。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.seconds = 0.0
+        self.rate_limit_rpm = 0
+        self.rate_limit_tpm = 0
+
+    def record_request(self, seconds):
+        """记录一次成功请求的耗时（秒）。"""
+        with self._lock:
+            self.requests += 1
+            self.seconds += seconds
+
+    def record_rate_limits(self, rpm, tpm):
+        """记录服务端返回的速率限制（例如 OpenAI 的 x-ratelimit-limit-* 响应头），0 表示未知。"""
+        with self._lock:
+            self.rate_limit_rpm = rpm or self.rate_limit_rpm
+            self.rate_limit_tpm = tpm or self.rate_limit_tpm
+
+    def save(self, path, model):
+        """将本次运行的实测值按模型写入统计文件，覆盖该模型之前的记录。"""
+        with self._lock:
+            if not self.requests:
+                return
+            entry = {
+                'seconds_per_request': self.seconds / self.requests,
+                'requests': self.requests,
+                'rate_limit_rpm': self.rate_limit_rpm,
+                'rate_limit_tpm': self.rate_limit_tpm,
+                'updated_at': time.time(),
+            }
+        data = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+        data[model] = entry
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def load_stats(path, model):
+    """读取统计文件中该模型的实测值，没有记录时返回 None。"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get(model)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class BudgetGuard:
+    """
+    运行时的 token / 费用预算控制。
+
+    提交批次前按预估值预留额度，请求完成后按实际用量记账；
+    已用额度加上预留额度达到上限后，不再允许提交新的批次。
+
+    默认只统计本进程的用量。设置共享存储（如 job_table.JobTable）后，
+    用量按整个作业统计，预留由存储在事务中完成（见 JobTable.reserve_budget）。
+    """
+
+    def __init__(self, model, max_tokens=0, max_cost=0, pricing=None, store=None):
+        """
+        参数:
+            model (str): 模型名称，用于计算费用。
+            max_tokens (int): token 上限，0 表示不限制。
+            max_cost (float): 费用上限（美元），0 表示不限制。
+            pricing (dict): 可选的价格表，见 estimate_cost。
+            store: 可选的共享用量存储，需提供 record_usage() 和 budget_usage()。
+        """
+        self.model = model
+        self.max_tokens = max_tokens or 0
+        self.max_cost = max_cost or 0
+        self.pricing = pricing
+        self.store = store
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._reserved_input = 0
+        self._reserved_output = 0
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        return bool(self.max_tokens or self.max_cost)
+
+    def cost_known(self):
+        """价格表中是否有该模型的价格；没有价格时无法按费用上限控制。"""
+        return self._cost(0, 0) is not None
+
+    def _cost(self, input_tokens, output_tokens):
+        return estimate_cost(self.model, input_tokens, output_tokens, self.pricing)
+
+    def allows(self, input_tokens, output_tokens):
+        """给定的总用量是否仍在预算之内。"""
+        if self.max_tokens and input_tokens + output_tokens > self.max_tokens:
+            return False
+        if self.max_cost:
+            cost = self._cost(input_tokens, output_tokens)
+            if cost is not None and cost > self.max_cost:
+                return False
+        return True
+
+    def try_reserve(self, input_tokens, output_tokens):
+        """为即将提交的批次预留额度，超出预算时返回 False。"""
+        with self._lock:
+            if not self.allows(
+                    self.input_tokens + self._reserved_input + input_tokens,
+                    self.output_tokens + self._reserved_output + output_tokens):
+                return False
+            self._reserved_input += input_tokens
+            self._reserved_output += output_tokens
+            return True
+
+    def release(self, input_tokens, output_tokens):
+        """释放批次完成后的预留额度。"""
+        with self._lock:
+            self._reserved_input = max(0, self._reserved_input - input_tokens)
+            self._reserved_output = max(0, self._reserved_output - output_tokens)
+
+    def record(self, input_tokens, output_tokens):
+        """记录一次请求的实际用量。"""
+        with self._lock:
+            self.input_tokens += input_tokens or 0
+            self.output_tokens += output_tokens or 0
+        if self.store is not None:
+            self.store.record_usage(input_tokens, output_tokens)
+
+    def exhausted(self):
+        """已用额度加预留额度是否已达到上限。"""
+        if self.store is not None:
+            used_input, used_output, reserved_input, reserved_output = self.store.budget_usage()
+            used_input += reserved_input
+            used_output += reserved_output
+        else:
+            with self._lock:
+                used_input = self.input_tokens + self._reserved_input
+                used_output = self.output_tokens + self._reserved_output
+        if self.max_tokens and used_input + used_output >= self.max_tokens:
+            return True
+        if self.max_cost:
+            cost = self._cost(used_input, used_output)
+            return cost is not None and cost >= self.max_cost
+        return False
+
+    def _format_usage(self, label, input_tokens, output_tokens):
+        cost = self._cost(input_tokens, output_tokens)
+        cost_text = f"${cost:.4f}" if cost is not None else "未知"
+        return f"{label}: 输入 {input_tokens} token，输出 {output_tokens} token，费用 {cost_text}"
+
+    def summary(self):
+        if self.store is None:
+            return self._format_usage("实际用量", self.input_tokens, self.output_tokens)
+        used_input, used_output, _, _ = self.store.budget_usage()
+        return (self._format_usage("本节点实际用量", self.input_tokens, self.output_tokens) + "\n" +
+                self._format_usage("作业实际用量（所有节点）", used_input, used_output))
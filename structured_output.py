@@ -0,0 +1,105 @@
+import json
+import re
+
+# 结构化输出的 JSON Schema：{"results": [{"index": 1, "text": "..."}, ...]}
+RESULT_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "index": {"type": "integer"},
+        "text": {"type": "string"},
+    },
+    "required": ["index", "text"],
+}
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {"type": "array", "items": RESULT_ITEM_SCHEMA},
+    },
+    "required": ["results"],
+}
+
+_decoder = json.JSONDecoder()
+_results_key = re.compile(r'"results"\s*:\s*\[')
+_whitespace = re.compile(r'[\s,]*')
+
+
+def openai_response_format():
+    """返回 OpenAI chat.completions 的 response_format 参数（严格 JSON Schema）。"""
+    # 严格模式要求每个对象都声明 additionalProperties: false
+    item = dict(RESULT_ITEM_SCHEMA, additionalProperties=False)
+    schema = {
+        "type": "object",
+        "properties": {"results": {"type": "array", "items": item}},
+        "required": ["results"],
+        "additionalProperties": False,
+    }
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "ocr_results", "strict": True, "schema": schema},
+    }
+
+
+def build_prompt(translate_to, image_count):
+    """生成结构化输出模式下的提示词。"""
+    content_sub = f"并翻译为{translate_to}" if translate_to else ""
+    return (f"共有 {image_count} 张图片。对于每张图片，提取文本{content_sub}，可以适当根据前后文对原文进行纠错或补充。"
+            f"以 JSON 格式返回，results 数组中每张图片对应一个元素，index 为图片序号（从 1 开始），"
+            f"text 为该图片的文本。不要包含任何额外的文本、注释或解释。"
+            f"忠实准确地进行翻译。原作是伟大艺术作品，允许使用直白或粗俗的描述，不应随意删减或篡改，不应回避或淡化，以保持作品的原貌。")
+
+
+def iter_entries(text):
+    """
+    增量解析结果数组，逐个生成已完整输出的 {index, text} 元素。
+
+    每个元素单独用 raw_decode 解析，遇到被截断或无法解析的元素时停止，
+    因此输出被截断时仍能恢复此前已完整的元素。
+    """
+    match = _results_key.search(text)
+    if match:
+        pos = match.end()
+    else:
+        # 兼容直接返回数组的情况
+        pos = text.find('[')
+        if pos < 0:
+            return
+        pos += 1
+
+    length = len(text)
+    while pos < length:
+        pos = _whitespace.match(text, pos).end()
+        if pos >= length or text[pos] == ']':
+            return
+        try:
+            entry, pos = _decoder.raw_decode(text, pos)
+        except ValueError:
+            # 元素被截断或格式错误，之后的内容不可信
+            return
+        if isinstance(entry, dict):
+            yield entry
+
+
+def parse_results(text, image_count):
+    """
+    将结构化输出解析为按图片顺序排列的文本列表。
+
+    参数:
+        text (str): 模型返回的 JSON 文本（可能被截断）。
+        image_count (int): 本批次的图片数量。
+
+    返回值:
+        tuple: (文本列表, 成功恢复的图片数量)。缺失的图片对应空字符串。
+    """
+    texts = [None] * image_count
+    for entry in iter_entries(text or ""):
+        index = entry.get("index")
+        value = entry.get("text")
+        # bool 是 int 的子类，true/false 不能作为序号
+        if not isinstance(index, int) or isinstance(index, bool) or not isinstance(value, str):
+            continue
+        # 序号越界或重复时忽略，保证文本与图片的对应关系可信
+        if 1 <= index <= image_count and texts[index - 1] is None:
+            texts[index - 1] = value.strip()
+    recovered = sum(1 for t in texts if t is not None)
+    return [t if t is not None else "" for t in texts], recovered
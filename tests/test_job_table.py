@@ -0,0 +1,131 @@
+import time
+
+import pytest
+
+import job_table
+
+
+@pytest.fixture
+def table(tmp_path):
+    table = job_table.JobTable(str(tmp_path / "jobs.db"), job_key="job", lease_seconds=60)
+    table.populate([["a.png", "b.png"], ["c.png"]])
+    return table
+
+
+def test_populate_is_idempotent(table):
+    assert table.populate([["a.png", "b.png"], ["c.png"]]) == 0
+    assert table.remaining() == 2
+
+
+def test_batch_list_is_frozen_after_first_populate(table):
+    # 之后启动的节点看到目录中多了一个文件，批次切分随之改变
+    assert table.populate([["0.png", "a.png"], ["b.png", "c.png"]]) == 0
+    assert table.remaining() == 2
+    assert table.job_images() == ["a.png", "b.png", "c.png"]
+
+
+def test_expired_lease_is_reclaimed(table):
+    batch_id, images = table.claim("w1")
+    assert images == ["a.png", "b.png"]
+
+    # 租约有效期内其他节点只能领取下一个批次
+    other_id, _ = table.claim("w2")
+    assert other_id != batch_id
+    assert table.claim("w2") is None
+
+    # w1 宕机，租约过期后 w2 接管该批次
+    table.lease_seconds = -1
+    table.heartbeat("w1")
+    assert table.claim("w2") == (batch_id, images)
+
+
+def test_heartbeat_keeps_lease(table):
+    table.lease_seconds = 0.2
+    table.claim("w1")
+    table.claim("w1")
+    time.sleep(0.1)
+    table.heartbeat("w1")
+    time.sleep(0.15)
+    assert table.claim("w2") is None
+
+
+def test_double_commit_is_exactly_once(table):
+    batch_id, _ = table.claim("w1")
+    first = table.commit_results("w1", batch_id, [("a.png", "A1"), ("b.png", "B1")])
+    # 租约过期后被重新处理的同一批次不会覆盖已提交的结果
+    second = table.commit_results("w2", batch_id, [("a.png", "A2"), ("b.png", "B2")])
+    assert first == [("a.png", "A1"), ("b.png", "B1")]
+    assert second == []
+    assert sorted(table.fetch_results("")) == [("a.png", "A1"), ("b.png", "B1")]
+
+
+def test_empty_text_is_not_committed(table):
+    batch_id, _ = table.claim("w1")
+    committed = table.commit_results("w1", batch_id, [("a.png", ""), ("b.png", "B")])
+    assert committed == [("b.png", "B")]
+    assert table.fetch_results("a.png") == []
+
+
+def test_release_marks_failed_after_max_attempts(tmp_path):
+    table = job_table.JobTable(str(tmp_path / "jobs.db"), job_key="job", max_attempts=2)
+    table.populate([["a.png"]])
+    batch_id, _ = table.claim("w1")
+    assert table.release("w1", batch_id) is False
+    assert table.claim("w1")[0] == batch_id
+    assert table.release("w1", batch_id) is True
+    assert table.claim("w1") is None
+    assert table.remaining() == 0
+
+
+def test_jobs_are_isolated(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    first = job_table.JobTable(db_path, job_key=job_table.make_job_key(str(tmp_path / "in1"), 2))
+    second = job_table.JobTable(db_path, job_key=job_table.make_job_key(str(tmp_path / "in2"), 2))
+    first.populate([["a.png"]])
+    batch_id, _ = first.claim("w1")
+    first.commit_results("w1", batch_id, [("a.png", "A")])
+
+    # 同名文件在另一个作业中不会被视为已完成
+    assert second.populate([["a.png"]]) == 1
+    assert second.fetch_results("") == []
+    assert second.claim("w1")[1] == ["a.png"]
+
+
+
+def test_shared_budget_reservation(table):
+    allows = lambda input_tokens, output_tokens: input_tokens + output_tokens <= 100
+    first_id, _ = table.claim("w1")
+    second_id, _ = table.claim("w2")
+    assert table.reserve_budget("w1", first_id, 40, 20, allows)
+    # 两个节点的预留额度合计超出预算
+    assert not table.reserve_budget("w2", second_id, 40, 20, allows)
+    table.unclaim("w2", second_id)
+
+    table.record_usage(30, 10)
+    table.commit_results("w1", first_id, [("a.png", "A")])
+    assert table.budget_usage() == (30, 10, 0, 0)
+
+    # 归还的批次不计入尝试次数，结算后可以继续预留
+    batch_id, _ = table.claim("w2")
+    assert batch_id == second_id
+    assert table.reserve_budget("w2", batch_id, 40, 20, allows)
+
+
+def test_job_name_replaces_input_path():
+    # 以不同路径挂载同一共享存储的节点通过相同的 job_name 加入同一作业
+    assert (job_table.make_job_key("/mnt/a/in", 2, "scan") ==
+            job_table.make_job_key("/net/share/in", 2, "scan"))
+    assert job_table.make_job_key("/mnt/a/in", 2, "scan") != job_table.make_job_key("/mnt/a/in", 3, "scan")
+    assert job_table.make_job_key("/mnt/a/in", 2) != job_table.make_job_key("/net/share/in", 2)
+
+
+def test_finished_count_includes_blank_and_failed_batches(tmp_path):
+    table = job_table.JobTable(str(tmp_path / "jobs.db"), job_key="job", max_attempts=1)
+    table.populate([["a.png", "b.png"], ["c.png"]])
+    first_id, _ = table.claim("w1")
+    # 空白页面没有写入结果表，但仍计入已完成的页面
+    table.commit_results("w1", first_id, [("a.png", ""), ("b.png", "")])
+    assert table.finished_count() == 2
+    second_id, _ = table.claim("w1")
+    assert table.release("w1", second_id) is True
+    assert table.finished_count() == 3
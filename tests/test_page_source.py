@@ -0,0 +1,124 @@
+import pytest
+from PIL import Image
+
+import page_source
+
+COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255)]
+
+
+def make_multi_page(path, count=len(COLORS)):
+    frames = [Image.new('RGB', (32, 24), color) for color in COLORS[:count]]
+    frames[0].save(str(path), save_all=True, append_images=frames[1:])
+    return str(path)
+
+
+class FakeRasterizer:
+    """模拟 PDF 渲染器，记录实际渲染的页码。"""
+
+    def __init__(self, count):
+        self.count = count
+        self.rendered = []
+
+    def __call__(self, path, first_page=0):
+        for index in range(first_page, self.count):
+            self.rendered.append(index)
+            yield Image.new('RGB', (10, 10), COLORS[index % len(COLORS)])
+
+
+def test_page_ref_round_trip():
+    ref = page_source.page_ref('scan.tiff', 2)
+    assert ref == 'scan.tiff#page3'
+    assert page_source.parse_page_ref(ref) == ('scan.tiff', 2)
+    assert page_source.parse_page_ref('doc.pdf#page10') == ('doc.pdf', 9)
+
+
+def test_parse_page_ref_keeps_plain_names():
+    assert page_source.parse_page_ref('photo.png') == ('photo.png', None)
+    # 只有多页格式的文件名才会被解析为页面引用
+    assert page_source.parse_page_ref('odd#page2.png') == ('odd#page2.png', None)
+    assert page_source.parse_page_ref('a.png#page2') == ('a.png#page2', None)
+
+
+@pytest.mark.parametrize('name', ['doc.tiff', 'anim.gif'])
+def test_iter_page_items_decodes_lazily(tmp_path, monkeypatch, name):
+    make_multi_page(tmp_path / name)
+    Image.new('RGB', (8, 8), 'white').save(str(tmp_path / 'a.png'))
+
+    decoded = []
+    original = page_source.ImageSequence.Iterator
+
+    class CountingIterator(original):
+        def __next__(self):
+            frame = super().__next__()
+            decoded.append(frame.tell())
+            return frame
+
+    monkeypatch.setattr(page_source.ImageSequence, 'Iterator', CountingIterator)
+    items = page_source.iter_page_items(str(tmp_path), ['a.png', name])
+    assert next(items) == ('a.png', None)
+    assert decoded == []
+
+    ref, page = next(items)
+    assert ref == f'{name}#page1'
+    assert page.convert('RGB').getpixel((0, 0)) == COLORS[0]
+    assert decoded == [0]
+
+    rest = list(items)
+    assert [ref for ref, _ in rest] == [f'{name}#page{i}' for i in range(2, len(COLORS) + 1)]
+    assert decoded == list(range(len(COLORS)))
+
+
+def test_iter_page_items_with_fake_pdf_rasterizer(tmp_path):
+    (tmp_path / 'book.pdf').write_bytes(b'%PDF-1.4')
+    rasterizer = FakeRasterizer(3)
+    items = page_source.iter_page_items(str(tmp_path), ['book.pdf'], rasterizer)
+    assert next(items)[0] == 'book.pdf#page1'
+    assert rasterizer.rendered == [0]
+    assert [ref for ref, _ in items] == ['book.pdf#page2', 'book.pdf#page3']
+
+
+def test_iter_batches_splits_across_files():
+    batches = list(page_source.iter_batches(iter(range(5)), 2))
+    assert batches == [[0, 1], [2, 3], [4]]
+
+
+def test_load_page_seeks_without_walking_frames(tmp_path, monkeypatch):
+    path = make_multi_page(tmp_path / 'doc.tiff')
+
+    def no_iteration(*args, **kwargs):
+        raise AssertionError('load_page 不应从第一页开始遍历')
+
+    monkeypatch.setattr(page_source.ImageSequence, 'Iterator', no_iteration)
+    assert page_source.load_page(path, 3).getpixel((0, 0)) == COLORS[3]
+    with pytest.raises(IndexError):
+        page_source.load_page(path, len(COLORS))
+
+
+def test_load_page_renders_pdf_from_requested_page(tmp_path):
+    rasterizer = FakeRasterizer(4)
+    page = page_source.load_page(str(tmp_path / 'book.pdf'), 2, rasterizer)
+    assert page.getpixel((0, 0)) == COLORS[2]
+    assert rasterizer.rendered == [2]
+    with pytest.raises(IndexError):
+        page_source.load_page(str(tmp_path / 'book.pdf'), 4, rasterizer)
+
+
+def test_count_pages_and_sizes_from_headers(tmp_path):
+    path = make_multi_page(tmp_path / 'doc.tiff', 3)
+    assert page_source.count_pages(path) == 3
+    assert page_source.page_sizes(path) == [(32, 24)] * 3
+    refs = list(page_source.iter_page_refs(str(tmp_path), ['doc.tiff']))
+    assert refs == ['doc.tiff#page1', 'doc.tiff#page2', 'doc.tiff#page3']
+
+
+def test_group_pages_and_format_document():
+    results = [('a.png', 'single'), ('doc.tiff#page2', 'second'),
+               ('doc.tiff#page1', ' first '), ('doc.tiff#page3', '')]
+    singles, documents = page_source.group_pages(results)
+    assert singles == [('a.png', 'single')]
+    assert list(documents) == ['doc.tiff']
+
+    text = page_source.format_document(documents['doc.tiff'])
+    assert text == ("===== 第 1 页 =====\nfirst\n\n"
+                    "===== 第 2 页 =====\nsecond\n\n"
+                    "===== 第 3 页 =====\n")
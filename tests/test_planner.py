@@ -0,0 +1,63 @@
+import planner
+
+
+class FakeStore:
+    def __init__(self, used_input=0, used_output=0, reserved_input=0, reserved_output=0):
+        self.usage = [used_input, used_output, reserved_input, reserved_output]
+
+    def record_usage(self, input_tokens, output_tokens):
+        self.usage[0] += input_tokens
+        self.usage[1] += output_tokens
+
+    def budget_usage(self):
+        return tuple(self.usage)
+
+
+def test_cost_known():
+    assert planner.BudgetGuard("gpt-4o", max_cost=1).cost_known()
+    assert not planner.BudgetGuard("gpt-4-vision-preview", max_cost=1).cost_known()
+    assert planner.BudgetGuard("my-model", max_cost=1, pricing={"my-model": [1, 2]}).cost_known()
+
+
+def test_local_reservation():
+    guard = planner.BudgetGuard("gpt-4o", max_tokens=100)
+    assert guard.try_reserve(50, 30)
+    assert not guard.try_reserve(10, 20)
+    guard.release(50, 30)
+    guard.record(40, 20)
+    assert guard.try_reserve(20, 20)
+    assert guard.exhausted()
+
+
+def test_store_tracks_job_usage():
+    store = FakeStore(used_input=60, used_output=20)
+    guard = planner.BudgetGuard("gpt-4o", max_tokens=100, store=store)
+    assert not guard.exhausted()
+    guard.record(10, 10)
+    # 其他节点的用量同样计入预算
+    assert guard.exhausted()
+    assert guard.input_tokens == 10
+
+
+def test_plan_prefers_observed_throughput(tmp_path):
+    from PIL import Image
+    for name in ("a.png", "b.png"):
+        Image.new("RGB", (512, 512), "white").save(str(tmp_path / name))
+    configured = planner.plan_directory(str(tmp_path), "openai", "gpt-4o", 1, 1, seconds_per_request=20)
+    assert configured["seconds"] == 40 and configured["latency_source"] == "configured"
+
+    stats = planner.ThroughputStats()
+    stats.record_request(2.0)
+    stats.record_request(4.0)
+    stats.record_rate_limits(6, 0)
+    path = str(tmp_path / planner.STATS_FILE)
+    stats.save(path, "gpt-4o")
+    assert planner.load_stats(path, "gpt-4o-mini") is None
+
+    observed = planner.plan_directory(str(tmp_path), "openai", "gpt-4o", 1, 1, seconds_per_request=20,
+                                      observed=planner.load_stats(path, "gpt-4o"))
+    # 实测 3 秒/请求，但每分钟 6 次请求的限制使 2 次请求需要 20 秒
+    assert observed["seconds_per_request"] == 3.0
+    assert observed["seconds"] == 20
+    assert observed["latency_source"] == "observed" and observed["limits_source"] == "observed"
+    assert "实测" in planner.format_plan(observed)
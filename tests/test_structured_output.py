@@ -0,0 +1,38 @@
+import structured_output
+
+
+def test_parses_complete_output():
+    text = '{"results": [{"index": 2, "text": " B "}, {"index": 1, "text": "A"}]}'
+    assert structured_output.parse_results(text, 2) == (["A", "B"], 2)
+
+
+def test_recovers_entries_before_truncation():
+    text = '{"results": [{"index": 1, "text": "A"}, {"index": 2, "text": "B"}, {"index": 3, "te'
+    assert structured_output.parse_results(text, 3) == (["A", "B", ""], 2)
+
+
+def test_truncated_inside_string_keeps_complete_entries():
+    text = '{"results": [{"index": 1, "text": "A"}, {"index": 2, "text": "unterminated'
+    assert structured_output.parse_results(text, 2) == (["A", ""], 1)
+
+
+def test_ignores_out_of_range_indexes():
+    text = '{"results": [{"index": 0, "text": "zero"}, {"index": 3, "text": "three"}, {"index": 2, "text": "B"}]}'
+    assert structured_output.parse_results(text, 2) == (["", "B"], 1)
+
+
+def test_keeps_first_duplicate_index():
+    text = '{"results": [{"index": 1, "text": "first"}, {"index": 1, "text": "second"}]}'
+    assert structured_output.parse_results(text, 1) == (["first"], 1)
+
+
+def test_ignores_boolean_and_non_integer_indexes():
+    text = ('{"results": [{"index": true, "text": "bool"}, {"index": "1", "text": "str"}, '
+            '{"index": 1.0, "text": "float"}, {"index": 1, "text": 5}]}')
+    assert structured_output.parse_results(text, 1) == ([""], 0)
+
+
+def test_accepts_bare_array_and_garbage():
+    assert structured_output.parse_results('[{"index": 1, "text": "A"}]', 1) == (["A"], 1)
+    assert structured_output.parse_results("not json", 2) == (["", ""], 0)
+    assert structured_output.parse_results(None, 1) == ([""], 0)
@@ -0,0 +1,86 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+import text_region
+
+# A4 @ 300 dpi
+PAGE_SIZE = (2480, 3508)
+
+
+def blank_page():
+    return Image.new('RGB', PAGE_SIZE, 'white')
+
+
+def draw_line(img, left, top, glyphs, height, stroke=4, fill=(0, 0, 0)):
+    """用竖笔画和横笔画模拟一行文字，不依赖字体文件。"""
+    draw = ImageDraw.Draw(img)
+    x = left
+    for index in range(glyphs):
+        draw.rectangle((x, top, x + stroke - 1, top + height - 1), fill=fill)
+        if index % 2:
+            draw.rectangle((x, top + height // 2, x + height // 2, top + height // 2 + stroke - 1), fill=fill)
+        x += height * 3 // 4
+    return img
+
+
+def ink_box(img):
+    ys, xs = np.nonzero(np.asarray(img.convert('L')) < 250)
+    return xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+
+
+def assert_contains_ink(box, img):
+    left, top, right, bottom = ink_box(img)
+    assert box[0] <= left and box[1] <= top and box[2] >= right and box[3] >= bottom
+
+
+def test_blank_page_is_skipped():
+    assert text_region.detect_text_regions(blank_page()) == []
+    assert text_region.reduce_to_text(blank_page()) is None
+
+
+def test_scanner_noise_is_skipped():
+    rng = np.random.default_rng(0)
+    pixels = np.clip(rng.normal(245, 4, PAGE_SIZE[::-1]), 0, 255).astype(np.uint8)
+    pixels.flat[rng.integers(0, pixels.size, 300)] = 60
+    assert text_region.reduce_to_text(Image.fromarray(pixels)) is None
+
+
+def test_single_short_line_is_kept():
+    # 例如只有一行 "Chapter 3" 的章节页
+    page = draw_line(blank_page(), 300, 400, glyphs=9, height=40)
+    reduced = text_region.reduce_to_text(page)
+    assert reduced is not None
+    assert reduced.width * reduced.height < PAGE_SIZE[0] * PAGE_SIZE[1] * 0.1
+
+
+def test_faint_small_text_is_kept():
+    page = blank_page()
+    for row in range(3):
+        draw_line(page, 300, 400 + row * 40, glyphs=30, height=20, stroke=2, fill=(160, 160, 160))
+    assert text_region.reduce_to_text(page) is not None
+
+
+def test_crop_box_contains_all_ink():
+    lines = [(300, 400, 9, 40), (1800, 3000, 4, 60)]
+    page = blank_page()
+    for left, top, glyphs, height in lines:
+        draw_line(page, left, top, glyphs, height)
+    regions = sorted(text_region.detect_text_regions(page))
+    assert len(regions) == 2
+    for region, (left, top, glyphs, height) in zip(regions, lines):
+        assert_contains_ink(region, draw_line(blank_page(), left, top, glyphs, height))
+
+    reduced = text_region.reduce_to_text(page, text_region.MODE_CROP)
+    left, top, right, bottom = ink_box(page)
+    assert reduced.width >= right - left and reduced.height >= bottom - top
+
+
+def test_prepare_image_keeps_original_when_cropping_does_not_help(tmp_path):
+    img = Image.new('RGB', (200, 200), 'white')
+    for top in range(2, 190, 16):
+        draw_line(img, 2, top, glyphs=22, height=12, stroke=2)
+    path = str(tmp_path / 'full.png')
+    img.save(path)
+    stats = text_region.TextRegionStats()
+    assert text_region.prepare_image(path, stats=stats) == path
+    assert stats.images == 1 and stats.skipped == 0
@@ -0,0 +1,199 @@
+import math
+import threading
+import numpy as np
+from PIL import Image
+
+# 支持的裁剪模式
+MODE_CROP = 'crop'   # 裁掉文本区域外的空白边框
+MODE_PACK = 'pack'   # 将检测到的文本区域紧凑拼接为一张图片
+MODES = (MODE_CROP, MODE_PACK)
+
+# 检测时将图片按整数倍缩小到不超过该最长边以加快计算
+ANALYSIS_MAX_SIDE = 1000
+# 灰度差超过该值的像素视为边缘
+EDGE_THRESHOLD = 40
+# 行中边缘像素数达到该值时视为可能包含文本（按像素数而非占比，页面上的短行也能被检测到）
+MIN_ROW_EDGES = 2
+# 区域内边缘像素占比低于该值时视为噪点（只按区域本身计算，与页面其余部分是否空白无关）
+MIN_LINE_DENSITY = 0.02
+# 面积（分析图像素）小于该值的区域视为噪点
+MIN_REGION_PIXELS = 16
+# 裁剪后面积占比超过该值时不值得裁剪，直接上传原图
+MIN_SAVING_RATIO = 0.9
+# 拼接区域之间的间隔（像素）
+PACK_GAP = 16
+
+
+def _runs(mask, max_gap, min_length=1):
+    """返回布尔序列中连续 True 段的 (起点, 终点) 列表，间隔不超过 max_gap 的段会被合并。"""
+    indices = np.flatnonzero(mask)
+    if indices.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indices) > max_gap + 1)
+    starts = np.concatenate(([indices[0]], indices[breaks + 1]))
+    ends = np.concatenate((indices[breaks], [indices[-1]])) + 1
+    return [(int(s), int(e)) for s, e in zip(starts, ends) if e - s >= min_length]
+
+
+def _edge_mask(gray):
+    """基于相邻像素灰度差计算边缘掩码。"""
+    edges = np.zeros(gray.shape, dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(gray, axis=1)) > EDGE_THRESHOLD
+    edges[1:, :] |= np.abs(np.diff(gray, axis=0)) > EDGE_THRESHOLD
+    return edges
+
+
+def detect_text_regions(img):
+    """
+    使用边缘密度和投影轮廓检测图片中的文本区域（仅使用 CPU）。
+
+    先按行投影找出包含文本的横向条带，再在每个条带内按列投影找出文本块。
+    是否为文本只按每个文本块自身的面积和边缘密度判断，因此大部分空白的页面上
+    只有一行短文本时也不会被当作空白页。
+
+    参数:
+        img (PIL.Image): 要检测的图片。
+
+    返回值:
+        list: 文本区域的 (left, top, right, bottom) 列表（原图坐标），没有文本时为空列表。
+    """
+    width, height = img.size
+    factor = max(1, math.ceil(max(width, height) / float(ANALYSIS_MAX_SIDE)))
+    gray = img.convert('L')
+    if factor > 1:
+        # 按块取平均缩小，细笔画和浅色文字的对比度比双线性插值保留得更好
+        gray = gray.reduce(factor)
+    gray = np.asarray(gray, dtype=np.int16)
+    edges = _edge_mask(gray)
+    small_h, small_w = edges.shape
+
+    if not edges.any():
+        return []
+
+    # 允许的行/列间隔与边距随图片尺寸变化
+    row_gap = max(2, small_h // 100)
+    col_gap = max(4, small_w // 25)
+    padding = max(2, min(small_w, small_h) // 100)
+
+    regions = []
+    row_edges = edges.sum(axis=1)
+    for top, bottom in _runs(row_edges >= MIN_ROW_EDGES, row_gap, min_length=2):
+        band = edges[top:bottom]
+        col_mask = band.any(axis=0)
+        for left, right in _runs(col_mask, col_gap, min_length=2):
+            if (right - left) * (bottom - top) < MIN_REGION_PIXELS:
+                continue
+            if band[:, left:right].mean() < MIN_LINE_DENSITY:
+                continue
+            regions.append((
+                max(0, (left - padding) * factor),
+                max(0, (top - padding) * factor),
+                min(width, (right + padding) * factor),
+                min(height, (bottom + padding) * factor),
+            ))
+    return regions
+
+
+def _pack_regions(img, regions):
+    """将文本区域按从上到下的顺序纵向拼接为一张白底图片。"""
+    crops = [img.crop(box) for box in sorted(regions, key=lambda box: (box[1], box[0]))]
+    width = max(crop.width for crop in crops)
+    height = sum(crop.height for crop in crops) + PACK_GAP * (len(crops) - 1)
+    composite = Image.new('RGB', (width, height), 'white')
+    y = 0
+    for crop in crops:
+        composite.paste(crop, (0, y))
+        y += crop.height + PACK_GAP
+    return composite
+
+
+def reduce_to_text(img, mode=MODE_CROP):
+    """
+    根据检测到的文本区域缩小图片。
+
+    参数:
+        img (PIL.Image): 原始图片。
+        mode (str): 'crop' 裁掉空白边框；'pack' 将文本区域拼接为紧凑的合成图。
+
+    返回值:
+        PIL.Image | None: 缩小后的图片；不值得缩小时返回原图；没有检测到文本时返回 None。
+    """
+    regions = detect_text_regions(img)
+    if not regions:
+        return None
+
+    original_area = img.width * img.height
+    bbox = (min(box[0] for box in regions), min(box[1] for box in regions),
+            max(box[2] for box in regions), max(box[3] for box in regions))
+    candidate = img.crop(bbox)
+    if mode == MODE_PACK and len(regions) > 1:
+        packed = _pack_regions(img.convert('RGB'), regions)
+        if packed.width * packed.height < candidate.width * candidate.height:
+            candidate = packed
+
+    if candidate.width * candidate.height > original_area * MIN_SAVING_RATIO:
+        return img
+    # 裁剪结果会被重新编码为 PNG，统一为 PNG 支持的颜色模式
+    return candidate if candidate.mode in ('RGB', 'RGBA', 'L') else candidate.convert('RGB')
+
+
+class TextRegionStats:
+    """线程安全地统计文本区域裁剪节省的像素数和跳过 API 的图片数。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.skipped = 0
+        self.pixels_before = 0
+        self.pixels_after = 0
+
+    def record(self, pixels_before, pixels_after):
+        """记录一张图片的处理结果；pixels_after 为 0 表示该图片没有文本被跳过。"""
+        with self._lock:
+            self.images += 1
+            self.pixels_before += pixels_before
+            self.pixels_after += pixels_after
+            if pixels_after == 0:
+                self.skipped += 1
+
+    def summary(self):
+        saved = self.pixels_before - self.pixels_after
+        ratio = saved / self.pixels_before * 100 if self.pixels_before else 0.0
+        return (f"文本区域检测: 共 {self.images} 张图片，节省 {saved} 像素 ({ratio:.1f}%)，"
+                f"{self.skipped} 张图片未检测到文本，已跳过 API 请求")
+
+
+def prepare_image(image, mode=MODE_CROP, stats=None):
+    """
+    上传前的文本区域预处理。
+
+    参数:
+        image (str | PIL.Image): 图片文件路径或已解码的页面。
+        mode (str): 裁剪模式，见 reduce_to_text。
+        stats (TextRegionStats): 可选的统计对象。
+
+    返回值:
+        str | PIL.Image | None: 需要上传的图片；无需裁剪时原样返回输入；没有文本时返回 None。
+    """
+    if isinstance(image, str):
+        with Image.open(image) as opened:
+            opened.load()
+            img = opened
+    else:
+        img = image
+
+    reduced = reduce_to_text(img, mode)
+    pixels_before = img.width * img.height
+    if reduced is None:
+        pixels_after = 0
+    elif reduced is img:
+        pixels_after = pixels_before
+    else:
+        pixels_after = reduced.width * reduced.height
+    if stats is not None:
+        stats.record(pixels_before, pixels_after)
+
+    if reduced is img:
+        # 未裁剪时保持原输入，普通图片仍按原文件上传
+        return image
+    return reduced